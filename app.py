@@ -1,12 +1,18 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Update, Bot, User, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputMediaDocument
+)
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.utils.request import Request
 from telegram.ext import (
     Updater,
+    Dispatcher,
     CommandHandler,
     MessageHandler,
     Filters,
     CallbackContext,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    ChatMemberHandler
 )
 import re
 from flask import Flask, request, jsonify
@@ -14,6 +20,32 @@ import os
 import html
 import threading
 import time
+import heapq
+import itertools
+import hashlib
+import hmac
+import bisect
+import subprocess
+from collections import OrderedDict, deque, namedtuple
+import sqlite3
+import json
+import atexit
+import contextlib
+import queue
+import asyncio
+import io
+import sys
+import uvicorn
+import functools
+import signal
+import ctypes
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # Optional: faster parsing of webhook bodies
+    json_loads = json.loads
 
 
 
@@ -35,43 +67,1503 @@ WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 if not WEBHOOK_URL:
     raise ValueError("WEBHOOK_URL environment variable not set")
 
+BOT_API_URL = os.getenv("BOT_API_URL", "https://api.telegram.org/bot")  # Override to point at a local fake API
+
 MAIN_ADMIN_ID = 7117744807  # Admin of the main bot
 LOG_CHANNEL = -1002542255709   # Channel for logging
 
-# Improved database using dictionary with persistence
-user_db = {}
+DATABASE_PATH = os.getenv("DATABASE_PATH", "builder.db")
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", 1.0))  # Seconds between write-behind flushes
+BOT_RESTORE_WORKERS = int(os.getenv("BOT_RESTORE_WORKERS", 32))  # Concurrent set_webhook calls at startup
+AUTO_DELETE_WORKERS = int(os.getenv("AUTO_DELETE_WORKERS", 4))  # Threads running due auto-deletions
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", 5000))  # Cached force-sub checks per bot
+MEMBER_CACHE_TTL = float(os.getenv("MEMBER_CACHE_TTL", 300))  # Seconds a "member" result is trusted
+MEMBER_NEGATIVE_TTL = float(os.getenv("MEMBER_NEGATIVE_TTL", 30))  # Seconds a "left"/"kicked" result is trusted
+CHANNEL_CACHE_SIZE = int(os.getenv("CHANNEL_CACHE_SIZE", 10000))  # Channels kept in the shared info cache
+SESSION_TTL = float(os.getenv("SESSION_TTL", 900))  # Seconds an unfinished flow (add bot, support, edit setting) stays open
+SESSION_MAX = int(os.getenv("SESSION_MAX", 50000))  # Open flows kept (~330 bytes each); the oldest are dropped beyond this
+CHANNEL_CACHE_TTL = float(os.getenv("CHANNEL_CACHE_TTL", 3600))  # Seconds before channel info must be refetched
+CHANNEL_REFRESH_AFTER = float(os.getenv("CHANNEL_REFRESH_AFTER", 600))  # Age that triggers a background refresh
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 8))  # Threads making outbound send calls
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 64))  # Keep-alive connections shared by all child bots
+SEND_RATE_PER_BOT = float(os.getenv("SEND_RATE_PER_BOT", 30))  # Messages/second per bot token
+SEND_RATE_PER_CHAT = float(os.getenv("SEND_RATE_PER_CHAT", 1))  # Messages/second per destination chat
+SEND_BURST_PER_CHAT = int(os.getenv("SEND_BURST_PER_CHAT", 3))  # Messages a quiet chat may receive at once
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 5))  # Attempts after 429s/connection errors
+
+LOG_DIGEST = os.getenv("LOG_DIGEST", "").lower() in ("1", "true", "yes")  # Combine text logs into periodic posts
+LOG_DIGEST_INTERVAL = float(os.getenv("LOG_DIGEST_INTERVAL", 5))  # Seconds between digest posts
+LOG_DIGEST_MAX_ENTRIES = int(os.getenv("LOG_DIGEST_MAX_ENTRIES", 2000))  # Queued entries before new ones are dropped
+LOG_DIGEST_MAX_CAPTION = 500  # Characters of message text kept per digest entry
+LOG_MEDIA_RATE = float(os.getenv("LOG_MEDIA_RATE", 0.33))  # Media copies/second into LOG_CHANNEL, all bots combined
+LOG_MEDIA_BURST = int(os.getenv("LOG_MEDIA_BURST", 5))
+MAX_MESSAGE_LENGTH = 4096
+
+WEB_SERVER = os.getenv("WEB_SERVER", "asgi")  # "asgi" (uvicorn) or "flask" (development server)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 16))  # Queue shards, each drained by one handler thread
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 10000))  # Queued updates (all shards) before 503
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 8))  # Seconds to finish queued work on SIGTERM (docker stop waits 10)
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", 4))  # Threads serving non-webhook routes under ASGI
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", 1024))  # Recent update_ids remembered per bot
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # X-Admin-Token for /debug routes; unset disables them
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", 1000))  # Log a stage breakdown above this, 0 = off
+SLOW_LOG_SIZE = int(os.getenv("SLOW_LOG_SIZE", 100))  # Slow updates kept for /debug/slow
+PROFILE_MAX_SECONDS = 60  # Longest sampling window /debug/profile accepts
+CAPTURE_PATH = os.getenv("CAPTURE_PATH")  # Append incoming updates here for bench/replay.py
+
+PAUSED_TEXT = "⏸️ <b>Bot sedang dijeda</b>\n\nAnda tidak bisa mengirim pesan sekarang."
+DUPLICATE_TEXT = "♻️ Pesan yang sama sudah pernah dikirim."
+
+FLOOD_USER_RATE = float(os.getenv("FLOOD_USER_RATE", 1))  # Messages/second one sender may push into a bot
+FLOOD_USER_BURST = int(os.getenv("FLOOD_USER_BURST", 5))
+FLOOD_BOT_RATE = float(os.getenv("FLOOD_BOT_RATE", 10))  # Messages/second a bot accepts (each costs ~3 sends)
+FLOOD_BOT_BURST = int(os.getenv("FLOOD_BOT_BURST", 50))
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", 3600))  # Seconds a forwarded submission is remembered (1-2 windows)
+DUPLICATE_CAPACITY = int(os.getenv("DUPLICATE_CAPACITY", 2000))  # Submissions per window; 4 bytes each per bot
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", 1.0))  # Seconds to collect album parts, 0 forwards them one by one
+ALBUM_MAX_PARTS = 10  # Telegram's album size limit
+PANEL_MESSAGES = 16  # Settings panel messages per bot whose displayed version is remembered
+PANEL_MESSAGE_TTL = 48 * 3600  # Telegram stops allowing edits to bot messages after 48 hours
+BOT_IDLE_TTL = float(os.getenv("BOT_IDLE_TTL", 1800))  # Seconds without updates before a bot is unloaded, 0 = never
+MAX_LOADED_BOTS = int(os.getenv("MAX_LOADED_BOTS", 0))  # Loaded bots kept (least recently used go first), 0 = no cap
+PARKED_BOT_TTL = float(os.getenv("PARKED_BOT_TTL", 3600))  # Seconds an unloaded bot's settings and dedup state are kept
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", 1))  # >1 runs a front router plus this many bot workers
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", -1))  # Set by the router in each worker process
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 9100))  # Worker i listens on 127.0.0.1:WORKER_BASE_PORT+i
+UNKNOWN_SECRET_CACHE_SIZE = 10000  # Webhook paths remembered as unknown, so junk requests skip the disk
+UNKNOWN_SECRET_TTL = 10  # Seconds before an unknown webhook path is looked up again
+WORKER_STABLE_AFTER = 30  # Seconds a restarted worker must stay up before its restart backoff resets
+WORKER_MAX_BACKOFF = 60  # Longest wait between restarts of a worker that keeps exiting
+
+# Updates child bots subscribe to; chat_member keeps the force-sub cache fresh
+CHILD_ALLOWED_UPDATES = ['message', 'callback_query', 'chat_member']
+
+_MISSING = object()
+
+class SettingsStore:
+    """Dict-like key/value store persisted to SQLite in WAL mode.
+
+    Reads go through an in-memory cache that is filled on first access (absent
+    keys are cached too). Writes only touch the cache and are flushed to disk
+    in batches by a background thread, so the message path does no disk I/O.
+    At most ``flush_interval`` seconds of writes are lost on a hard crash.
+    The database is opened and the flusher started on first use.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._cache = {}  # {key: value or _MISSING}
+        self._dirty = {}  # {key: value or _MISSING} waiting to be flushed
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._conn = None
+        self._stop = threading.Event()
+        atexit.register(self.close)
+
+    def _open(self):
+        """Return the connection, opening it and starting the flusher on first use"""
+        if self._conn is not None:
+            return self._conn
+        with self._open_lock:
+            if self._conn is None:
+                conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                threading.Thread(target=self._flush_loop, name="settings-flush", daemon=True).start()
+                self._conn = conn
+        return self._conn
+
+    def _lookup(self, key):
+        """Return the cached value for key, reading it from disk on a miss"""
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        
+        conn = self._open()
+        with self._db_lock:
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        value = json.loads(row[0]) if row else _MISSING
+        
+        # A write that raced with the disk read wins
+        with self._lock:
+            return self._cache.setdefault(key, value)
+
+    def _store(self, key, value):
+        if self._conn is None:
+            self._open()
+        with self._lock:
+            self._cache[key] = value
+            self._dirty[key] = value
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._store(key, value)
+
+    def __delitem__(self, key):
+        if self._lookup(key) is _MISSING:
+            raise KeyError(key)
+        self._store(key, _MISSING)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _MISSING
+
+    def pop(self, key, default=_MISSING):
+        value = self._lookup(key)
+        if value is _MISSING:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        self._store(key, _MISSING)
+        return value
+
+    def refresh(self, key, default=None):
+        """Re-read key from disk, picking up writes made by other processes.
+
+        Unlike get(), a key absent on disk is not cached as absent, so probing
+        arbitrary keys leaves nothing behind.
+        """
+        with self._lock:
+            if key in self._dirty:
+                value = self._cache[key]
+                return default if value is _MISSING else value
+            self._cache.pop(key, None)
+        
+        conn = self._open()
+        with self._db_lock:
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        with self._lock:
+            value = self._cache.setdefault(key, json.loads(row[0]))
+        return default if value is _MISSING else value
+
+    def items(self, prefix: str = ""):
+        """Return all persisted (key, value) pairs whose key starts with prefix"""
+        self.flush()
+        conn = self._open()
+        with self._db_lock:
+            rows = conn.execute(
+                "SELECT key, value FROM kv WHERE key >= ? AND key < ?",
+                (prefix, prefix + "\uffff")
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def flush(self):
+        """Write all pending changes to disk in a single transaction"""
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+        if not batch:
+            return
+        
+        upserts = [(k, json.dumps(v)) for k, v in batch.items() if v is not _MISSING]
+        deletes = [(k,) for k, v in batch.items() if v is _MISSING]
+        try:
+            conn = self._open()
+            with self._db_lock:
+                conn.execute("BEGIN")
+                try:
+                    conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", upserts)
+                    conn.executemany("DELETE FROM kv WHERE key = ?", deletes)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            logger.error(f"Failed to flush settings: {e}")
+            # Put the batch back without clobbering newer writes
+            with self._lock:
+                for key, value in batch.items():
+                    self._dirty.setdefault(key, value)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the background flusher and write out anything pending"""
+        self._stop.set()
+        self.flush()
+
+class DeleteScheduler:
+    """Shared scheduler for auto-deleting forwarded messages.
+
+    Pending deletions live in a heap ordered by deadline. A single timer
+    thread pops everything that is due, groups it per (bot, chat) and hands
+    each group to a small worker pool, so the thread count does not depend on
+    how many deletions are pending. Entries are persisted in batches to the
+    SQLite database so they survive a restart.
+    """
+
+    def __init__(self, path: str, delete_fn, workers: int = 4, flush_interval: float = 1.0):
+        self.path = path
+        self.delete_fn = delete_fn  # delete_fn(creator_id, chat_id, message_ids)
+        self.flush_interval = flush_interval
+        self._heap = []  # [(due, creator_id, chat_id, message_id)]
+        self._cond = threading.Condition()
+        self._to_save = []
+        self._to_forget = []
+        self._workers = workers
+        self._db_lock = threading.Lock()
+        self._pool = None
+        self._timer = None
+        self._stop = threading.Event()
+        self._conn = None
+
+    def start(self, owned=None):
+        """Open the database, load persisted deletions and start the timer thread.
+
+        owned(creator_id) limits loading to this process's bots when several
+        worker processes share the database.
+        """
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scheduled_deletes ("
+            "creator_id INTEGER, chat_id TEXT, message_id INTEGER, due REAL, "
+            "PRIMARY KEY (creator_id, chat_id, message_id))"
+        )
+        rows = self._conn.execute("SELECT due, creator_id, chat_id, message_id FROM scheduled_deletes").fetchall()
+        if owned:
+            rows = [row for row in rows if owned(row[1])]
+        with self._cond:
+            self._heap.extend(tuple(row) for row in rows)
+            heapq.heapify(self._heap)
+        logger.info(f"Loaded {len(rows)} pending auto-deletions")
+        
+        self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="auto-delete")
+        self._timer = threading.Thread(target=self._run, name="auto-delete-timer", daemon=True)
+        self._timer.start()
+        atexit.register(self.stop)
+
+    def schedule(self, creator_id: int, chat_id, message_id: int, delay: float):
+        """Delete message_id in chat_id of the given bot after delay seconds"""
+        entry = (time.time() + delay, creator_id, str(chat_id), message_id)
+        with self._cond:
+            self._to_save.append(entry)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                timeout = self.flush_interval
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - time.time())
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                
+                now = time.time()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+            
+            # Deletions falling due together in the same chat go out as one task
+            groups = {}
+            for _, creator_id, chat_id, message_id in due:
+                groups.setdefault((creator_id, chat_id), []).append(message_id)
+            for (creator_id, chat_id), message_ids in groups.items():
+                self._pool.submit(self._delete, creator_id, chat_id, message_ids)
+            
+            self.flush()
+
+    def _delete(self, creator_id, chat_id, message_ids):
+        try:
+            self.delete_fn(creator_id, chat_id, message_ids)
+        except Exception as e:
+            logger.error(f"❌ Gagal menghapus pesan: {e}")
+        # Failed deletions are not retried, the message is usually gone already
+        with self._cond:
+            self._to_forget.extend((creator_id, chat_id, message_id) for message_id in message_ids)
+
+    def flush(self):
+        """Persist newly scheduled and completed deletions in one transaction"""
+        with self._cond:
+            to_save, self._to_save = self._to_save, []
+            to_forget, self._to_forget = self._to_forget, []
+        if not (to_save or to_forget):
+            return
+        
+        try:
+            with self._db_lock:
+                self._conn.execute("BEGIN")
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO scheduled_deletes (due, creator_id, chat_id, message_id) VALUES (?, ?, ?, ?)",
+                        to_save
+                    )
+                    self._conn.executemany(
+                        "DELETE FROM scheduled_deletes WHERE creator_id = ? AND chat_id = ? AND message_id = ?",
+                        to_forget
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            logger.error(f"Failed to persist auto-deletions: {e}")
+            with self._cond:
+                self._to_save[:0] = to_save
+                self._to_forget[:0] = to_forget
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._timer:
+            self._timer.join(timeout=5)
+            self.flush()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time-to-live"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # {key: (expires_at, value)}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+ChannelInfo = namedtuple('ChannelInfo', ['title', 'username'])
+
+# State of an unloaded bot handed to its next instance
+ParkedBot = namedtuple('ParkedBot', ['config', 'seen_updates', 'submissions', 'parked_at'])
+
+class ChannelCache:
+    """Channel title/username shared by all child bots.
+
+    Entries older than refresh_after are still served but refetched in the
+    background, so menus only wait on get_chat for channels never seen before
+    or not seen for a whole TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, refresh_after: float):
+        self.refresh_after = refresh_after
+        self._cache = TTLCache(maxsize, ttl)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="channel-refresh")
+
+    def get(self, bot, chat_id) -> ChannelInfo:
+        """Return info for chat_id, calling get_chat through bot on a miss"""
+        key = str(chat_id)
+        entry = self._cache.get(key)
+        if entry is None:
+            return self._fetch(bot, key)
+        
+        fetched_at, info = entry
+        if time.monotonic() - fetched_at > self.refresh_after:
+            with self._lock:
+                stale = key not in self._refreshing
+                self._refreshing.add(key)
+            if stale:
+                self._pool.submit(self._refresh, bot, key)
+        return info
+
+    def put(self, chat) -> ChannelInfo:
+        """Store info from a Chat object we already have"""
+        info = ChannelInfo(chat.title, chat.username)
+        self._cache.set(str(chat.id), (time.monotonic(), info))
+        return info
+
+    def invalidate(self, chat_id):
+        self._cache.pop(str(chat_id))
+
+    def _fetch(self, bot, key) -> ChannelInfo:
+        chat = bot.get_chat(key)
+        info = ChannelInfo(chat.title, chat.username)
+        self._cache.set(key, (time.monotonic(), info))
+        return info
+
+    def _refresh(self, bot, key):
+        try:
+            self._fetch(bot, key)
+        except Exception as e:
+            logger.error(f"Failed to refresh channel info for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+class SessionStore:
+    """In-memory conversation state ("which flow is this user in"), keyed per user.
+
+    Every entry expires after its TTL. Expired entries are dropped when read,
+    from the front of the store on every write, and by a periodic sweep; past
+    max_entries the least recently set ones go first. State is lost on
+    restart, which only means the user starts the flow again.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, sweep_interval: float = 60):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.expired = 0
+        self.evicted = 0
+        self._data = OrderedDict()  # {key: (expires_at, value)}, least recently set first
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                self.expired += 1
+                return default
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            self._drop_expired(now, limit=2)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evicted += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None or entry[0] < time.monotonic() else entry[1]
+
+    def _drop_expired(self, now: float, limit: int = None) -> int:
+        """Drop expired entries from the front, stopping at the first live one (caller holds the lock)"""
+        dropped = 0
+        while self._data and (limit is None or dropped < limit):
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at >= now:
+                break
+            del self._data[key]
+            dropped += 1
+        self.expired += dropped
+        return dropped
+
+    def sweep(self) -> int:
+        """Drop every expired entry; return how many went"""
+        now = time.monotonic()
+        with self._lock:
+            dropped = self._drop_expired(now)
+            # Entries set with a shorter TTL can expire behind live ones
+            stale = [key for key, (expires_at, _) in self._data.items() if expires_at < now]
+            for key in stale:
+                del self._data[key]
+            self.expired += len(stale)
+        return dropped + len(stale)
+
+    def start(self):
+        """Sweep expired entries in the background"""
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweep", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'expired': self.expired, 'evicted': self.evicted}
+
+class RateLimiter:
+    """Token buckets (GCRA) keyed by bot or chat, one float of state per key.
+
+    Not thread-safe on its own; Outbox calls it under its lock.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, max_keys: int = 100000):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.max_keys = max_keys
+        self._tat = {}  # {key: theoretical arrival time}
+
+    def reserve(self, key, at: float) -> float:
+        """Reserve one send for key no earlier than at and return when it may go out"""
+        tat = self._tat.get(key, at)
+        send_at = max(at, tat - self.tolerance)
+        self._tat[key] = max(tat, send_at) + self.interval
+        if len(self._tat) > self.max_keys:
+            # Buckets that have fully refilled carry no state worth keeping
+            self._tat = {k: v for k, v in self._tat.items() if v > at}
+        return send_at
+
+    def has_room(self, key, at: float) -> bool:
+        """Whether allow(key, at) would succeed, without taking anything"""
+        return self._tat.get(key, at) - self.tolerance <= at
+
+    def allow(self, key, at: float, cost: float = 1.0) -> bool:
+        """Take cost tokens for key if its bucket has room at time at; never waits"""
+        tat = self._tat.get(key, at)
+        if tat - self.tolerance > at:
+            return False
+        self._tat[key] = max(tat, at) + self.interval * cost
+        if len(self._tat) > self.max_keys:
+            self._tat = {k: v for k, v in self._tat.items() if v > at}
+        return True
+
+    def block_until(self, key, until: float):
+        """Hold back key until the given time (used after a 429)"""
+        self._tat[key] = max(self._tat.get(key, until), until)
+
+
+class FloodControl:
+    """Admission check on incoming messages, per sender and per bot.
+
+    Runs on the raw update before it is queued, so a throttled message
+    costs no API call at all. Both levels are GCRA buckets (one float per
+    active key); a bucket that has refilled is dropped when its limiter
+    compacts. A rate of 0 disables that level.
+    """
+
+    def __init__(self, user_rate: float, user_burst: int, bot_rate: float, bot_burst: int):
+        self._users = RateLimiter(user_rate, user_burst) if user_rate > 0 else None
+        self._bots = RateLimiter(bot_rate, bot_burst) if bot_rate > 0 else None
+        self._lock = threading.Lock()
+
+    def admit(self, bot_key, user_id, cost: float = 1.0) -> str:
+        """Return None if the message may proceed, else the level that throttled it.
+
+        Only an admitted message is charged, so a sender isn't billed for
+        messages the bot-wide limit dropped.
+        """
+        now = time.monotonic()
+        user_key = (bot_key, user_id)
+        with self._lock:
+            if self._users and not self._users.has_room(user_key, now):
+                return 'user'
+            if self._bots and not self._bots.allow(bot_key, now, cost):
+                return 'bot'
+            if self._users:
+                self._users.allow(user_key, now, cost)
+        return None
+
+
+class SendJob:
+    __slots__ = ('bot', 'chat_id', 'method', 'kwargs', 'callback', 'errback', 'lane', 'attempts')
+
+    def __init__(self, bot, chat_id, method, kwargs, callback, errback, lane):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.callback = callback
+        self.errback = errback
+        self.lane = lane
+        self.attempts = 0
+
+
+class Outbox:
+    """Asynchronous outbound queue for Telegram send calls.
+
+    Every job reserves a slot in its destination chat's bucket and in its
+    bot's bucket, then waits in a heap until that slot comes up; a worker
+    pool makes the actual API calls. 429s push the job (and both buckets)
+    back by retry_after. Jobs may also name a lane, an extra bucket shared
+    by every bot (e.g. all media copies into the log channel). Callbacks run
+    on the worker thread.
+
+    Jobs for one (bot, chat) are sent one at a time, in submission order:
+    a due job whose chat already has a send in flight (or a job waiting on
+    a retry) is parked until that send finishes.
+    """
+
+    def __init__(self, workers: int, bot_rate: float, chat_rate: float, chat_burst: int, max_retries: int):
+        self.max_retries = max_retries
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._heap = []  # [(send_at, seq, job)]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._bot_limits = RateLimiter(bot_rate, max(1, int(bot_rate)))
+        self._chat_limits = RateLimiter(chat_rate, chat_burst)
+        self._lanes = {}  # {name: RateLimiter}
+        self._inflight = {}  # {(token, chat_id): job being sent or waiting for its retry}
+        self._parked = {}  # {(token, chat_id): deque of due jobs queued behind it}
+        self._parked_count = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+        self._thread = None  # Started with the first job
+
+    def add_lane(self, name: str, rate: float, burst: int = 1):
+        """Register a bucket that jobs submitted with lane=name share"""
+        self._lanes[name] = RateLimiter(rate, burst)
+
+    def submit(self, bot, chat_id, method: str, callback=None, errback=None, lane: str = None, **kwargs):
+        """Queue bot.<method>(chat_id=chat_id, **kwargs)"""
+        job = SendJob(bot, chat_id, method, kwargs, callback, errback, lane)
+        with self._cond:
+            self._schedule(job, time.monotonic())
+
+    def pending(self) -> int:
+        return len(self._heap) + self._parked_count
+
+    def drain(self, timeout: float):
+        """Wait up to timeout seconds for queued and in-flight jobs to finish"""
+        deadline = time.monotonic() + timeout
+        while (self._heap or self._inflight) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _schedule(self, job, at):
+        send_at = self._chat_limits.reserve((job.bot.token, str(job.chat_id)), at)
+        send_at = self._bot_limits.reserve(job.bot.token, send_at)
+        if job.lane:
+            send_at = self._lanes[job.lane].reserve(job.lane, send_at)
+        entry = (send_at, next(self._seq), job)
+        heapq.heappush(self._heap, entry)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="outbox-timer", daemon=True)
+            self._thread.start()
+        elif self._heap[0] is entry:
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                _, _, job = heapq.heappop(self._heap)
+                key = (job.bot.token, str(job.chat_id))
+                owner = self._inflight.setdefault(key, job)
+                if owner is not job:
+                    self._parked.setdefault(key, deque()).append(job)
+                    self._parked_count += 1
+                    continue
+            self._pool.submit(self._send, job)
+
+    def _release(self, job):
+        """Hand the chat of a finished job to the next job parked behind it"""
+        key = (job.bot.token, str(job.chat_id))
+        with self._cond:
+            parked = self._parked.get(key)
+            if not parked:
+                del self._inflight[key]
+                return
+            successor = parked.popleft()
+            self._parked_count -= 1
+            if not parked:
+                del self._parked[key]
+            self._inflight[key] = successor
+        self._pool.submit(self._send, successor)
+
+    def _retry(self, job, delay: float, block: bool = False):
+        job.attempts += 1
+        self.retried += 1
+        with self._cond:
+            at = time.monotonic() + delay
+            if block:
+                self._chat_limits.block_until((job.bot.token, str(job.chat_id)), at)
+                self._bot_limits.block_until(job.bot.token, at)
+            self._schedule(job, at)
+
+    def _send(self, job):
+        finished = True
+        try:
+            finished = self._attempt(job)
+        finally:
+            if finished:
+                self._release(job)
+
+    def _attempt(self, job) -> bool:
+        """Make the call; return False when the job went back into the heap for a retry"""
+        try:
+            result = getattr(job.bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+        except RetryAfter as e:
+            if job.attempts < self.max_retries:
+                self._retry(job, e.retry_after, block=True)
+                return False
+            error = e
+        except (BadRequest, TimedOut) as e:
+            # Not retried: the request was rejected, or may already have been delivered
+            error = e
+        except NetworkError as e:
+            if job.attempts < self.max_retries:
+                self._retry(job, 2 ** job.attempts)
+                return False
+            error = e
+        except Exception as e:
+            error = e
+        else:
+            self.sent += 1
+            if job.callback:
+                try:
+                    job.callback(result)
+                except Exception as e:
+                    logger.error(f"Error in {job.method} callback: {e}")
+            return True
+        
+        self.failed += 1
+        if job.errback:
+            try:
+                job.errback(error)
+            except Exception as e:
+                logger.error(f"Error in {job.method} errback: {e}")
+        else:
+            logger.error(f"Failed to {job.method} to {job.chat_id}: {error}")
+        return True
+
+    def stats(self) -> dict:
+        return {'pending': self.pending(), 'sent': self.sent, 'retried': self.retried, 'failed': self.failed}
+
+class LogDigest:
+    """Combines text log entries from all bots into periodic LOG_CHANNEL posts.
+
+    Entries wait in a bounded queue; every interval they are packed into as
+    few messages as fit in Telegram's length limit and sent by the main bot.
+    """
+
+    def __init__(self, interval: float, max_entries: int):
+        self.interval = interval
+        self.max_entries = max_entries
+        self.dropped = 0  # Entries discarded because the queue was full
+        self.overflowed = 0  # Entries cut down to fit into one message
+        self._entries = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._bot = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-digest", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def add(self, entry: str) -> bool:
+        """Queue one entry, returning False when it had to be dropped"""
+        if len(entry) > MAX_MESSAGE_LENGTH - 100:
+            entry = entry[:MAX_MESSAGE_LENGTH - 100]
+            self.overflowed += 1
+            metrics.inc('log_digest_overflowed_total')
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self.dropped += 1
+                metrics.inc('log_digest_dropped_total')
+                return False
+            self._entries.append(entry)
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            entries, self._entries = self._entries, deque()
+        if not entries:
+            return
+        if self._bot is None:
+            # Sent as the main bot; a plain Bot works in every worker process
+            self._bot = Bot(TOKEN, base_url=BOT_API_URL, request=shared_request)
+        
+        for text in self._pack(entries):
+            outbox.submit(self._bot, LOG_CHANNEL, 'send_message',
+                          errback=lambda e: logger.error(f"Failed to send log digest: {e}"),
+                          text=text, parse_mode='HTML', disable_web_page_preview=True)
+
+    @staticmethod
+    def _pack(entries):
+        """Join entries into messages no longer than MAX_MESSAGE_LENGTH"""
+        chunk = []
+        size = 0
+        for entry in entries:
+            if chunk and size + len(entry) + 2 > MAX_MESSAGE_LENGTH:
+                yield "\n\n".join(chunk)
+                chunk, size = [], 0
+            chunk.append(entry)
+            size += len(entry) + 2
+        if chunk:
+            yield "\n\n".join(chunk)
+
+    def stats(self) -> dict:
+        return {'queued': len(self._entries), 'dropped': self.dropped, 'overflowed': self.overflowed}
+
+class _ShardLocal(threading.local):
+    shard = None  # Class default: a miss is a plain attribute read, not a caught AttributeError
+
+class Metrics:
+    """Prometheus-style counters and histograms, recorded per thread.
+
+    Each thread writes only to its own dicts, so recording is a dict update
+    with no lock taken; render() sums the per-thread shards when scraped.
+    Shards of threads that have exited are folded into one retired shard,
+    so short-lived threads (one per request under Flask) don't pile up.
+    Metric families are declared up front with their label names, and
+    callers pass label values as a tuple in that order.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, prefix: str, buckets: tuple = BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._families = {}  # {name: (kind, help, label names)}
+        self._shards = []  # [(thread, counters, histograms)] one per live thread
+        self._retired = ({}, {})  # Totals of threads that have exited
+        self._local = _ShardLocal()
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, help_text: str, labels: tuple = ()):
+        self._families[name] = (kind, help_text, labels)
+
+    def _shard(self):
+        shard = self._local.shard
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._retire_dead()
+                self._shards.append((threading.current_thread(), *shard))
+        return shard
+
+    def _retire_dead(self):
+        """Fold the shards of exited threads into the retired totals (caller holds the lock)"""
+        live = []
+        for thread, counters, histograms in self._shards:
+            if thread.is_alive():
+                live.append((thread, counters, histograms))
+            else:
+                self._merge(self._retired, counters, histograms)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, counters, histograms):
+        totals, merged_histograms = into
+        for key, value in counters.copy().items():
+            totals[key] = totals.get(key, 0) + value
+        for key, counts in histograms.copy().items():
+            merged = merged_histograms.setdefault(key, [0] * len(counts))
+            for i, value in enumerate(counts[:]):
+                merged[i] += value
+
+    def inc(self, name: str, labels: tuple = (), amount: int = 1):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float):
+        histograms = self._shard()[1]
+        key = (name, labels)
+        counts = histograms.get(key)
+        if counts is None:
+            # One slot per bucket, one for +Inf, then the running sum
+            counts = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, gauges: dict = None) -> str:
+        """Text exposition of every family, plus gauges given as {name: value}"""
+        combined = ({}, {})
+        with self._lock:
+            self._retire_dead()
+            self._merge(combined, *self._retired)
+            shards = list(self._shards)
+        for _, counters, histograms in shards:
+            self._merge(combined, counters, histograms)
+        
+        by_name = {}
+        for (name, labels), value in {**combined[0], **combined[1]}.items():
+            by_name.setdefault(name, []).append((labels, value))
+        
+        lines = []
+        for name, (kind, help_text, label_names) in self._families.items():
+            if kind == 'gauge' and gauges and name in gauges:
+                by_name[name] = [((), gauges[name])]
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in sorted(by_name.get(name, ()), key=lambda item: item[0]):
+                pairs = [f'{k}="{self._escape(v)}"' for k, v in zip(label_names, labels)]
+                if kind != 'histogram':
+                    lines.append(f"{full}{{{','.join(pairs)}}} {value}" if pairs else f"{full} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le = ','.join(pairs + [f'le="{bound}"'])
+                    lines.append(f"{full}_bucket{{{le}}} {cumulative}")
+                labelled = f"{{{','.join(pairs)}}}" if pairs else ""
+                lines.append(f"{full}_sum{labelled} {value[-1]:.6f}")
+                lines.append(f"{full}_count{labelled} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _escape(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class InstrumentedRequest(Request):
+    """Request that counts Bot API calls by method and outcome"""
+
+    def post(self, url: str, data, timeout: float = None):
+        method = url.rsplit('/', 1)[-1]
+        trace = tracer.current()
+        start = trace.enter() if trace else time.perf_counter()
+        try:
+            result = super().post(url, data, timeout=timeout)
+        except Exception as e:
+            metrics.inc('telegram_api_calls_total', (method, type(e).__name__))
+            raise
+        finally:
+            metrics.observe('telegram_api_seconds', (method,), time.perf_counter() - start)
+            if trace:
+                trace.leave(f"api.{method}", start)
+        metrics.inc('telegram_api_calls_total', (method, 'ok'))
+        return result
+
+def timed(handler):
+    """Add a bot handler's run time to the current update's trace, under its name.
+
+    Handlers call each other, so latency metrics are recorded once per
+    update by process_bot_update rather than here, and the entry handlers
+    the dispatcher calls are covered by its 'dispatch' span.
+    """
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    def wrapper(self, *args, **kwargs):
+        trace = tracer.current()
+        if trace is None:
+            return handler(self, *args, **kwargs)
+        start = trace.enter()
+        try:
+            return handler(self, *args, **kwargs)
+        finally:
+            trace.leave(name, start)
+    return wrapper
+
+class UpdateTrace:
+    """Stage timings of one update, as (offset, depth, name, seconds) spans"""
+    __slots__ = ('label', 'update_id', 'wait', 'started', 'depth', 'spans')
+
+    def __init__(self, label: str, update_id, wait: float):
+        self.label = label
+        self.update_id = update_id
+        self.wait = wait
+        self.started = time.perf_counter()
+        self.depth = 0
+        self.spans = []
+
+    def enter(self) -> float:
+        self.depth += 1
+        return time.perf_counter()
+
+    def leave(self, name: str, start: float):
+        self.depth -= 1
+        self.spans.append((start - self.started, self.depth, name, time.perf_counter() - start))
+
+class _TraceLocal(threading.local):
+    trace = None  # Threads outside the update queue never set it, and read this default cheaply
+
+class UpdateTracer:
+    """Per-stage timers for updates, feeding the slow-update log.
+
+    The update thread opens a trace before running an update; @timed
+    handlers, Bot API calls and the de_json/dispatch steps add spans to it.
+    Updates slower than the threshold (queue wait included) are logged
+    with their breakdown and kept for /debug/slow.
+    """
+
+    def __init__(self, threshold: float, keep: int):
+        self.threshold = threshold
+        self.slow = deque(maxlen=keep)
+        self._local = _TraceLocal()
+
+    def current(self):
+        return self._local.trace
+
+    def begin(self, label: str, update_id, queued_at: float):
+        if self.threshold > 0:
+            self._local.trace = UpdateTrace(label, update_id, time.monotonic() - queued_at)
+
+    def span(self, name: str):
+        trace = self.current()
+        return _Span(trace, name) if trace else contextlib.nullcontext()
+
+    def end(self):
+        trace = self.current()
+        if trace is None:
+            return
+        self._local.trace = None
+        total = trace.wait + time.perf_counter() - trace.started
+        if total < self.threshold:
+            return
+        
+        stages = [f"{'  ' * depth}{name} {seconds * 1000:.1f}ms"
+                  for _, depth, name, seconds in sorted(trace.spans)]
+        self.slow.append({
+            'bot': trace.label, 'update_id': trace.update_id, 'at': time.time(),
+            'total_ms': round(total * 1000, 1), 'queue_ms': round(trace.wait * 1000, 1), 'stages': stages,
+        })
+        logger.warning(f"Slow update {trace.update_id} for {trace.label}: {total * 1000:.0f}ms "
+                       f"(queued {trace.wait * 1000:.0f}ms) " + "; ".join(s.strip() for s in stages))
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: UpdateTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.trace.enter()
+
+    def __exit__(self, *exc):
+        self.trace.leave(self.name, self.start)
+
+class SamplingProfiler:
+    """Wall-clock stack sampler producing flamegraph collapsed stacks.
+
+    Samples sys._current_frames() of the selected threads at a fixed
+    interval for a bounded window; only one window runs at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def collect(self, seconds: float, interval: float, thread_prefix: str = ''):
+        """Return collapsed stacks ("root;frame;frame count" lines), or None if busy"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            counts = {}
+            me = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    name = names.get(ident, 'unknown')
+                    if ident == me or not name.startswith(thread_prefix):
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    # Shards and pool threads ("update-3", "outbox_1") fold into one root
+                    stack.append(re.sub(r'[-_]?\d+$', '', name))
+                    key = ';'.join(reversed(stack))
+                    counts[key] = counts.get(key, 0) + 1
+                time.sleep(interval)
+            return ''.join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+        finally:
+            self._lock.release()
+
+metrics = Metrics('anonbot')
+metrics.describe('updates_received_total', 'counter', "Webhook updates received", ('bot', 'type'))
+metrics.describe('updates_throttled_total', 'counter', "Messages dropped by flood control", ('bot', 'level'))
+metrics.describe('duplicates_rejected_total', 'counter', "Resubmissions rejected by the dedup filter", ('bot',))
+metrics.describe('handler_seconds', 'histogram', "Time to run an update through its handlers", ('bot', 'type'))
+metrics.describe('telegram_api_calls_total', 'counter', "Bot API calls by outcome", ('method', 'status'))
+metrics.describe('telegram_api_seconds', 'histogram', "Bot API call latency", ('method',))
+metrics.describe('active_bots', 'gauge', "Child bots loaded in this process")
+metrics.describe('registered_bots', 'gauge', "Child bots this process serves, loaded or not")
+metrics.describe('bot_activation_seconds', 'histogram', "Time to build a bot on its first update")
+metrics.describe('bots_unloaded_total', 'counter', "Bots unloaded by reason", ('reason',))
+metrics.describe('auto_delete_pending', 'gauge', "Scheduled deletions not yet due")
+metrics.describe('update_queue_depth', 'gauge', "Updates waiting for a handler thread")
+metrics.describe('outbox_pending', 'gauge', "Send jobs waiting for their rate-limit slot")
+metrics.describe('open_sessions', 'gauge', "Unfinished add-bot, support and settings-edit flows")
+metrics.describe('log_digest_queued', 'gauge', "Log entries waiting for the next digest post")
+metrics.describe('log_digest_dropped_total', 'counter', "Log entries discarded because the digest queue was full")
+metrics.describe('log_digest_overflowed_total', 'counter', "Log entries cut down to fit into one message")
+
+tracer = UpdateTracer(SLOW_UPDATE_MS / 1000, SLOW_LOG_SIZE)
+profiler = SamplingProfiler()
+
+class TrafficRecorder:
+    """Append-only capture of incoming webhook updates for bench/replay.py.
+
+    Each line is {"t": arrival time, "bot": bot id (0 for the main bot),
+    "update": payload}. Personal strings (message text, names, usernames,
+    and with them any bot token a user pastes to the main bot) are
+    replaced by filler of the same shape, keeping a leading /command.
+    Redaction and writes happen on a background thread.
+    """
+    REDACTED = {'text', 'caption', 'first_name', 'last_name', 'username', 'title', 'phone_number',
+                'bio', 'description', 'query', 'invite_link'}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        threading.Thread(target=self._run, name="capture", daemon=True).start()
+
+    def record(self, bot_id: int, payload: dict):
+        self._queue.put((time.time(), bot_id, payload))
+
+    @classmethod
+    def redact(cls, value, key: str = None):
+        if isinstance(value, dict):
+            return {k: cls.redact(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [cls.redact(v) for v in value]
+        if key in cls.REDACTED and isinstance(value, str):
+            command = value.split(' ', 1)[0] if value.startswith('/') else ''
+            return command + re.sub(r'\S', 'x', value[len(command):])
+        return value
+
+    def _run(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                at, bot_id, payload = self._queue.get()
+                try:
+                    f.write(json.dumps({'t': round(at, 3), 'bot': bot_id, 'update': self.redact(payload)},
+                                       separators=(',', ':'), ensure_ascii=False) + "\n")
+                    if self._queue.empty():
+                        f.flush()
+                except Exception as e:
+                    logger.error(f"Failed to capture update: {e}")
+
+class SubmissionFilter:
+    """Recently forwarded submissions of one bot, as two rotating Bloom filters.
+
+    Keys go into the current generation; once it holds `capacity` keys or
+    is `window` seconds old it becomes the previous one and a fresh one
+    starts, so lookups cover one to two windows in a fixed 2 * capacity *
+    BITS_PER_KEY bits. At 16 bits and 11 hashes per key about 1 in 2000
+    new submissions is mistaken for a duplicate.
+    """
+    BITS_PER_KEY = 16
+    HASHES = 11
+
+    def __init__(self, capacity: int, window: float):
+        self.capacity = capacity
+        self.window = window
+        self.size = capacity * self.BITS_PER_KEY
+        self._current = bytearray((self.size + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.HASHES)]
+
+    def _rotate(self):
+        age = time.monotonic() - self._started
+        if self._count < self.capacity and age < self.window:
+            return
+        # After two idle windows the current generation is stale as well
+        self._previous = self._current if age < 2 * self.window else bytearray(len(self._current))
+        self._current = bytearray(len(self._current))
+        self._count = 0
+        self._started = time.monotonic()
+
+    def seen(self, key: str) -> bool:
+        positions = self._positions(key)
+        with self._lock:
+            self._rotate()
+            for bits in (self._current, self._previous):
+                for p in positions:
+                    if not bits[p >> 3] & (1 << (p & 7)):
+                        break
+                else:
+                    return True
+            return False
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        with self._lock:
+            self._rotate()
+            for p in positions:
+                self._current[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+
+    def expired(self) -> bool:
+        """Whether everything in the filter is older than the two windows it covers"""
+        return time.monotonic() - self._started >= 2 * self.window
+
+def submission_key(text: str = None, file_unique_id: str = None):
+    """Dedup key of a submission: the media's file_unique_id, else its normalized text"""
+    if file_unique_id:
+        return f"f:{file_unique_id}"
+    if text:
+        return "t:" + " ".join(text.casefold().split())
+    return None
+
+class AlbumCollector:
+    """Groups the parts of a media album, which arrive as one update each.
+
+    The first part of a media_group_id opens a group; after `window`
+    seconds, or once max_parts parts arrived, flush_fn(bot, messages) gets
+    the parts in order so the album can be forwarded with one call.
+    """
+
+    def __init__(self, window: float, flush_fn, max_parts: int = ALBUM_MAX_PARTS):
+        self.window = window
+        self.flush_fn = flush_fn
+        self.max_parts = max_parts
+        self._groups = {}  # {(bot secret, chat_id, media_group_id): (bot, [messages])}
+        self._heap = []  # [(deadline, key)]
+        self._cond = threading.Condition()
+        self._thread = None  # Started with the first album
+
+    def add(self, bot, message):
+        key = (bot.webhook_secret, message.chat_id, message.media_group_id)
+        with self._cond:
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = (bot, [])
+                heapq.heappush(self._heap, (time.monotonic() + self.window, key))
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="albums", daemon=True)
+                    self._thread.start()
+                self._cond.notify()
+            group[1].append(message)
+            full = len(group[1]) >= self.max_parts
+            if full:
+                del self._groups[key]
+        if full:
+            self._flush(group)
+
+    def pending(self) -> int:
+        return len(self._groups)
+
+    def flush_all(self):
+        """Forward every waiting album now, without waiting out its window"""
+        with self._cond:
+            groups = list(self._groups.values())
+            self._groups.clear()
+            self._heap.clear()
+        for group in groups:
+            self._flush(group)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                _, key = heapq.heappop(self._heap)
+                group = self._groups.pop(key, None)
+            if group:
+                self._flush(group)
+
+    def _flush(self, group):
+        bot, messages = group
+        try:
+            self.flush_fn(bot, sorted(messages, key=lambda message: message.message_id))
+        except Exception as e:
+            logger.error(f"Failed to forward album: {e}")
+
+# Bot settings and flags, persisted across restarts
+user_db = SettingsStore(DATABASE_PATH, DB_FLUSH_INTERVAL)
+
+# Channel metadata shared by every child bot
+channel_cache = ChannelCache(CHANNEL_CACHE_SIZE, CHANNEL_CACHE_TTL, CHANNEL_REFRESH_AFTER)
+
+# Unfinished add-bot, support and settings-edit flows, per user
+sessions = SessionStore(SESSION_TTL, SESSION_MAX)
+
+# One keep-alive connection pool to the Bot API for every child bot
+shared_request = InstrumentedRequest(con_pool_size=HTTP_POOL_SIZE)
+
+# Rate-limited sender used by the anonymous message path
+outbox = Outbox(SEND_WORKERS, SEND_RATE_PER_BOT, SEND_RATE_PER_CHAT, SEND_BURST_PER_CHAT, SEND_MAX_RETRIES)
+outbox.add_lane('log_media', LOG_MEDIA_RATE, LOG_MEDIA_BURST)
+
+# Optional batching of text log entries (LOG_DIGEST=1)
+log_digest = LogDigest(LOG_DIGEST_INTERVAL, LOG_DIGEST_MAX_ENTRIES)
+
+# Ingress throttling of child bot messages
+flood_control = FloodControl(FLOOD_USER_RATE, FLOOD_USER_BURST, FLOOD_BOT_RATE, FLOOD_BOT_BURST)
+
+# Album parts waiting to be forwarded together
+albums = AlbumCollector(ALBUM_WINDOW, lambda bot, messages: bot.send_album(messages))
+
+# Optional traffic capture for replay (CAPTURE_PATH=...)
+traffic_recorder = TrafficRecorder(CAPTURE_PATH) if CAPTURE_PATH else None
+
+WEBHOOK_SECRET_RE = re.compile(r'[0-9a-f]{32}')
+
+def webhook_secret(token: str) -> str:
+    """Derive the webhook path segment for a bot so raw tokens stay out of URLs and logs"""
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+# Toggle callback suffix -> BotSettings flag
+MODE_TOGGLES = {
+    'text_mode': 'text_enabled',
+    'photo_mode': 'photo_enabled',
+    'sticker_mode': 'sticker_enabled',
+    'doc_mode': 'doc_enabled',
+    'dedup': 'dedup',
+}
+
+class BotSettings:
+    """Settings of one anonymous bot, loaded once and saved as a single record"""
+    FIELDS = ('start_text', 'reply_text', 'channel_id', 'delete_delay', 'paused', 'fsub',
+              'text_enabled', 'photo_enabled', 'sticker_enabled', 'doc_enabled', 'dedup')
+    __slots__ = ('key', 'version') + FIELDS
+
+    def __init__(self, key: str):
+        self.key = key
+        self.version = 0  # Bumped on every save, so views rendered from the settings know they are stale
+        self.start_text = None  # None means "use the default text"
+        self.reply_text = None
+        self.channel_id = None
+        self.delete_delay = 0  # Seconds, 0 disables auto-delete
+        self.paused = False
+        self.fsub = False
+        self.text_enabled = True
+        self.photo_enabled = True
+        self.sticker_enabled = True
+        self.doc_enabled = True
+        self.dedup = False  # Reject resubmitted texts and media
+
+    @classmethod
+    def load(cls, username: str) -> 'BotSettings':
+        """Load settings of a bot, migrating the legacy per-field user_db keys"""
+        config = cls(f'settings_{username}')
+        record = user_db.get(config.key)
+        if record is not None:
+            for field, value in record.items():
+                if field in cls.FIELDS:
+                    setattr(config, field, value)
+            return config
+        
+        delay = user_db.get(f'del_{username}')
+        config.start_text = user_db.get(f'startText_{username}')
+        config.reply_text = user_db.get(f'kirimText_{username}')
+        config.channel_id = user_db.get(f'channel_{username}')
+        config.delete_delay = int(delay) if delay and delay.isdigit() else 0
+        config.paused = user_db.get(f'jeda_{username}') == 'iya'
+        config.fsub = user_db.get(f'fsub_{username}') == 'iya'
+        config.text_enabled = not user_db.get(f'modeText_{username}')
+        config.photo_enabled = not user_db.get(f'modeFoto_{username}')
+        config.sticker_enabled = not user_db.get(f'modeSticker_{username}')
+        config.doc_enabled = not user_db.get(f'modeBerkas_{username}')
+        return config
+
+    def save(self):
+        """Persist the settings record"""
+        self.version += 1
+        user_db[self.key] = {field: getattr(self, field) for field in self.FIELDS}
+
 
 class AnonymousBot:
-    def __init__(self, token: str, creator_id: int):
-        """Initialize an anonymous messaging bot"""
+    def __init__(self, token: str, creator_id: int, username: str = None, bot_id: int = None):
+        """Initialize an anonymous messaging bot.
+
+        When username and bot_id are known (e.g. restored from the registry)
+        the get_me round-trip is skipped.
+        """
         self.token = token
         self.creator_id = creator_id  # The user who created this bot becomes admin
+        self.webhook_secret = webhook_secret(token)
+        self.webhook_url = f"{WEBHOOK_URL}/webhook/{self.webhook_secret}"
         
         try:
-            self.updater = Updater(token, use_context=True)
-            self.dispatcher = self.updater.dispatcher
+            # Child bots share one connection pool and run no threads of their own
+            self.bot = Bot(token, base_url=BOT_API_URL, request=shared_request)
+            self.dispatcher = Dispatcher(self.bot, None, workers=1)
             
             # Get bot info
-            self.username = self.updater.bot.get_me().username
+            if username and bot_id:
+                self.bot._bot = User(bot_id, username, True, username=username, bot=self.bot)
+            self.username = self.bot.username
+            self.config = BotSettings.load(self.username)
+            self.member_cache = TTLCache(MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL)
+            self.seen_updates = UpdateWindow(DEDUP_WINDOW)
+            self.last_used = time.monotonic()  # Read by BotManager's idle eviction
+            self.submissions = None  # SubmissionFilter, once dedup is used
+            self.panel = None  # (settings version, text, markup) of the rendered settings panel
+            self.panel_messages = None  # TTLCache {message_id: settings version shown}, once a panel is sent
             
             # Register handlers
             self._register_handlers()
             
-            # Set webhook
-            webhook_url = f"{WEBHOOK_URL}/webhook/{token}"
-            self.updater.bot.set_webhook(webhook_url)
-            logger.info(f"Webhook set for bot @{self.username} to {webhook_url}")
-            
-            # Send confirmation to creator
-            self.updater.bot.send_message(
-                chat_id=creator_id,
-                text=f"✅ Bot @{self.username} berhasil diaktifkan!\n\n"
-                     f"Gunakan /settings di bot untuk mengkonfigurasinya."
-            )
-            
         except Exception as e:
             logger.error(f"Failed to initialize bot: {e}")
             raise
+    
+    def set_webhook(self, record: dict = None) -> bool:
+        """Point the bot's webhook at us unless the registry says it already is"""
+        if (record and record.get('webhook_url') == self.webhook_url
+                and record.get('allowed_updates') == CHILD_ALLOWED_UPDATES):
+            return False
+        self.bot.set_webhook(self.webhook_url, allowed_updates=CHILD_ALLOWED_UPDATES)
+        logger.info(f"Webhook set for bot @{self.username} to {self.webhook_url}")
+        return True
+    
+    def notify_creator(self):
+        """Send activation confirmation to the creator"""
+        self.bot.send_message(
+            chat_id=self.creator_id,
+            text=f"✅ Bot @{self.username} berhasil diaktifkan!\n\n"
+                 f"Gunakan /settings di bot untuk mengkonfigurasinya."
+        )
+    
+    def to_record(self) -> dict:
+        """Registry record used to restore the bot after a restart"""
+        return {
+            'token': self.token,
+            'creator_id': self.creator_id,
+            'username': self.username,
+            'id': self.bot.id,
+            'webhook_url': self.webhook_url,
+            'allowed_updates': CHILD_ALLOWED_UPDATES,
+        }
         
     def _register_handlers(self):
         """Register all handlers for the bot"""
@@ -79,6 +1571,7 @@ class AnonymousBot:
         self.dispatcher.add_handler(CommandHandler("settings", self.settings))
         self.dispatcher.add_handler(CallbackQueryHandler(self.button_handler))
         self.dispatcher.add_handler(MessageHandler(Filters.all & ~Filters.command, self.message_handler))
+        self.dispatcher.add_handler(ChatMemberHandler(self.chat_member_handler, ChatMemberHandler.CHAT_MEMBER))
     
     def start(self, update: Update, context: CallbackContext):
         """Handle /start command"""
@@ -96,31 +1589,45 @@ class AnonymousBot:
             return
         
         # Send welcome message
-        welcome_text = user_db.get(f'startText_{self.username}', 
-                                 "Halo! Selamat datang di bot menfes anonim.")
+        welcome_text = self.config.start_text or "Halo! Selamat datang di bot menfes anonim."
         update.message.reply_text(welcome_text)
     
     def _check_subscription(self, update: Update, context: CallbackContext) -> bool:
         """Check if user is subscribed to required channel"""
-        channel_id = user_db.get(f'channel_{self.username}')
-        if user_db.get(f'fsub_{self.username}') == 'iya' and channel_id:
-            try:
-                member = context.bot.get_chat_member(channel_id, update.effective_user.id)
-                if member.status in ['left', 'kicked']:
-                    channel_info = context.bot.get_chat(channel_id)
-                    keyboard = [[InlineKeyboardButton("Join Channel", url=f"https://t.me/{channel_info.username}")]]
-                    update.message.reply_text(
-                        "🔗 <b>Anda harus join channel dulu</b>\n\nSetelah join, ketik /start lagi",
-                        parse_mode='HTML',
-                        reply_markup=InlineKeyboardMarkup(keyboard)
-                    )
-                    return False
-            except Exception as e:
-                logger.error(f"Error checking channel membership: {e}")
-                update.message.reply_text("❌ Gagal memverifikasi keanggotaan channel.")
+        channel_id = self.config.channel_id
+        return not (self.config.fsub and channel_id) or self._check_membership(update, context, channel_id)
+    
+    @timed
+    def _check_membership(self, update: Update, context: CallbackContext, channel_id) -> bool:
+        """Force-sub check of the sender against channel_id, asking non-members to join"""
+        try:
+            cache_key = (channel_id, update.effective_user.id)
+            status = self.member_cache.get(cache_key)
+            if status is None:
+                status = context.bot.get_chat_member(channel_id, update.effective_user.id).status
+                left = status in ['left', 'kicked']
+                self.member_cache.set(cache_key, status, MEMBER_NEGATIVE_TTL if left else None)
+            
+            if status in ['left', 'kicked']:
+                channel_info = channel_cache.get(context.bot, channel_id)
+                keyboard = [[InlineKeyboardButton("Join Channel", url=f"https://t.me/{channel_info.username}")]]
+                update.message.reply_text(
+                    "🔗 <b>Anda harus join channel dulu</b>\n\nSetelah join, ketik /start lagi",
+                    parse_mode='HTML',
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
                 return False
+        except Exception as e:
+            logger.error(f"Error checking channel membership: {e}")
+            update.message.reply_text("❌ Gagal memverifikasi keanggotaan channel.")
+            return False
         return True
     
+    def chat_member_handler(self, update: Update, context: CallbackContext):
+        """Drop cached force-sub results when someone joins or leaves the channel"""
+        change = update.chat_member
+        self.member_cache.pop((str(change.chat.id), change.new_chat_member.user.id))
+    
     def settings(self, update: Update, context: CallbackContext):
         """Handle /settings command (admin only)"""
         # Get the appropriate message object (works for both commands and callback queries)
@@ -132,21 +1639,41 @@ class AnonymousBot:
                              parse_mode='HTML')
             return
         
+        version, settings_text, reply_markup = self._settings_panel()
+        
+        # Edit message if it's a callback query, otherwise send new message
+        if update.callback_query:
+            if self.panel_messages is not None and self.panel_messages.get(message.message_id) == version:
+                return  # The message already shows this panel
+            try:
+                update.callback_query.edit_message_text(settings_text, parse_mode='HTML', reply_markup=reply_markup)
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+            self._panel_shown(message.message_id, version)
+        else:
+            sent = message.reply_text(settings_text, parse_mode='HTML', reply_markup=reply_markup)
+            self._panel_shown(sent.message_id, version)
+    
+    def _settings_panel(self):
+        """Return (settings version, text, markup) of the settings panel, rendered once per version"""
+        if self.panel is not None and self.panel[0] == self.config.version:
+            return self.panel
+        
         # Get current settings
-        welcome_text = user_db.get(f'startText_{self.username}', 
-                                 "👋 Halo! Selamat datang di bot menfes anonim.")
-        auto_reply = user_db.get(f'kirimText_{self.username}', 
-                               "✅ Pesan Anda telah terkirim secara anonim!")
-        channel = user_db.get(f'channel_{self.username}')
-        delete_time = user_db.get(f'del_{self.username}')
-        is_paused = user_db.get(f'jeda_{self.username}') == 'iya'
-        fsub_enabled = user_db.get(f'fsub_{self.username}') == 'iya'
+        config = self.config
+        welcome_text = config.start_text or "👋 Halo! Selamat datang di bot menfes anonim."
+        auto_reply = config.reply_text or "✅ Pesan Anda telah terkirim secara anonim!"
+        channel = config.channel_id
+        delete_time = config.delete_delay
+        is_paused = config.paused
+        fsub_enabled = config.fsub
         
         # Text mode status with emojis
-        text_mode = "✅ Aktif" if not user_db.get(f'modeText_{self.username}') else "❌ Nonaktif"
-        photo_mode = "✅ Aktif" if not user_db.get(f'modeFoto_{self.username}') else "❌ Nonaktif"
-        sticker_mode = "✅ Aktif" if not user_db.get(f'modeSticker_{self.username}') else "❌ Nonaktif"
-        doc_mode = "✅ Aktif" if not user_db.get(f'modeBerkas_{self.username}') else "❌ Nonaktif"
+        text_mode = "✅ Aktif" if config.text_enabled else "❌ Nonaktif"
+        photo_mode = "✅ Aktif" if config.photo_enabled else "❌ Nonaktif"
+        sticker_mode = "✅ Aktif" if config.sticker_enabled else "❌ Nonaktif"
+        doc_mode = "✅ Aktif" if config.doc_enabled else "❌ Nonaktif"
         
         # Button layout
         keyboard = [
@@ -160,9 +1687,10 @@ class AnonymousBot:
             keyboard.append([InlineKeyboardButton("📢 Set Channel", callback_data='set_channel')])
        
         keyboard.extend([    
-            [InlineKeyboardButton(f"⏱️ Auto Delete: {delete_time + ' detik' if delete_time else 'Nonaktif'}", callback_data='set_delete_time')],
+            [InlineKeyboardButton(f"⏱️ Auto Delete: {f'{delete_time} detik' if delete_time else 'Nonaktif'}", callback_data='set_delete_time')],
             [InlineKeyboardButton(f"⏸️ Mode Jeda: {'Aktif' if is_paused else 'Nonaktif'}", callback_data='toggle_pause')],
             [InlineKeyboardButton(f"🔗 Force Sub: {'Aktif' if fsub_enabled else 'Nonaktif'}", callback_data='toggle_fsub')],
+            [InlineKeyboardButton(f"♻️ Anti Duplikat: {'Aktif' if config.dedup else 'Nonaktif'}", callback_data='toggle_dedup')],
             [
                 InlineKeyboardButton(f"Teks: {text_mode}", callback_data='toggle_text_mode'),
                 InlineKeyboardButton(f"Foto: {photo_mode}", callback_data='toggle_photo_mode')
@@ -181,112 +1709,104 @@ class AnonymousBot:
             f"📝 <b>Pesan Welcome:</b>\n<code>{html.escape(welcome_text[:60])}{'...' if len(welcome_text) > 60 else ''}</code>\n\n"
             f"📩 <b>Auto Reply:</b>\n<code>{html.escape(auto_reply[:60])}{'...' if len(auto_reply) > 60 else ''}</code>\n\n"
             f"📢 <b>Channel Terhubung:</b> <code>{channel if channel else 'Tidak ada'}</code>\n"
-            f"⏱️ <b>Auto Delete:</b> <code>{delete_time + ' detik' if delete_time else 'Nonaktif'}</code>\n\n"
+            f"⏱️ <b>Auto Delete:</b> <code>{f'{delete_time} detik' if delete_time else 'Nonaktif'}</code>\n\n"
             "🛠️ <b>Status Fitur:</b>\n"
             f"- Teks: <b>{text_mode}</b>\n"
             f"- Foto: <b>{photo_mode}</b>\n"
             f"- Stiker: <b>{sticker_mode}</b>\n"
-            f"- Dokumen: <b>{doc_mode}</b>\n\n"
+            f"- Dokumen: <b>{doc_mode}</b>\n"
+            f"- Anti Duplikat: <b>{'✅ Aktif' if config.dedup else '❌ Nonaktif'}</b>\n\n"
             "🔧 Silakan pilih opsi di bawah:"
         )
         
-        # Edit message if it's a callback query, otherwise send new message
-        if update.callback_query:
-            update.callback_query.edit_message_text(
-                settings_text,
-                parse_mode='HTML',
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        else:
-            message.reply_text(
-                settings_text,
-                parse_mode='HTML',
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+        self.panel = (config.version, settings_text, InlineKeyboardMarkup(keyboard))
+        return self.panel
+    
+    def _panel_shown(self, message_id: int, version: int):
+        """Remember which settings version a chat message displays"""
+        if self.panel_messages is None:
+            self.panel_messages = TTLCache(PANEL_MESSAGES, PANEL_MESSAGE_TTL)
+        self.panel_messages.set(message_id, version)
       
     def button_handler(self, update: Update, context: CallbackContext):
         """Handle inline button presses"""
         query = update.callback_query
-        query.answer()
-        
         action = query.data
         
-        # Main settings actions
-        if action == 'back_to_settings':
+        # Toggle actions answer with a notice and redraw the panel in a single edit
+        if action.startswith('toggle_'):
+            query.answer(self._handle_toggle_action(action[7:]))
             self.settings(update, context)
+            return
         
-        # Toggle actions
-        elif action.startswith('toggle_'):
-            self._handle_toggle_action(query, action[7:])
+        query.answer()
+        
+        # Main settings actions
+        if action == 'back_to_settings':
+            sessions.pop(('editing', self.username, query.from_user.id))  # Leaving a prompt abandons it
             self.settings(update, context)
         
         # Set actions
         elif action.startswith('set_'):
+            if self.panel_messages is not None:
+                self.panel_messages.pop(query.message.message_id)  # The message is about to show something else
             self._handle_set_action(query, action[4:])
     
-    def _handle_toggle_action(self, query, action_type):
-        """Handle toggle actions (pause, fsub, modes)"""
-        bot_username = self.username
+    def _handle_toggle_action(self, action_type):
+        """Handle toggle actions (pause, fsub, modes); return the notice for the button press"""
+        config = self.config
+        notice = None
         
         if action_type == 'pause':
-            current = user_db.get(f'jeda_{bot_username}')
-            user_db[f'jeda_{bot_username}'] = 'iya' if not current else None
-            query.edit_message_text(f"⏸️ Mode jeda {'diaktifkan' if not current else 'dinonaktifkan'}")
+            config.paused = not config.paused
+            notice = f"⏸️ Mode jeda {'diaktifkan' if config.paused else 'dinonaktifkan'}"
         
         elif action_type == 'fsub':
-            current = user_db.get(f'fsub_{bot_username}')
-            user_db[f'fsub_{bot_username}'] = 'iya' if not current else None
-            query.edit_message_text(f"🔗 Force sub {'diaktifkan' if not current else 'dinonaktifkan'}")
-        
-        elif action_type == 'text_mode':
-            current = user_db.get(f'modeText_{bot_username}')
-            user_db[f'modeText_{bot_username}'] = 'nonaktif' if not current else None
+            config.fsub = not config.fsub
+            notice = f"🔗 Force sub {'diaktifkan' if config.fsub else 'dinonaktifkan'}"
         
-        elif action_type == 'photo_mode':
-            current = user_db.get(f'modeFoto_{bot_username}')
-            user_db[f'modeFoto_{bot_username}'] = 'nonaktif' if not current else None
+        elif action_type in MODE_TOGGLES:
+            field = MODE_TOGGLES[action_type]
+            setattr(config, field, not getattr(config, field))
         
-        elif action_type == 'sticker_mode':
-            current = user_db.get(f'modeSticker_{bot_username}')
-            user_db[f'modeSticker_{bot_username}'] = 'nonaktif' if not current else None
+        else:
+            return None
         
-        elif action_type == 'doc_mode':
-            current = user_db.get(f'modeBerkas_{bot_username}')
-            user_db[f'modeBerkas_{bot_username}'] = 'nonaktif' if not current else None
+        config.save()
+        return notice
     
     def _handle_set_action(self, query, action_type):
         """Handle set actions (welcome, autoreply, channel, delete time)"""
         bot_username = self.username
         
         if action_type == 'welcome':
-            current_text = user_db.get(f'startText_{bot_username}', 
-                                     "Halo! Selamat datang di bot menfes anonim.")
+            current_text = self.config.start_text or "Halo! Selamat datang di bot menfes anonim."
             query.edit_message_text(
                 f"📝 <b>Set Pesan Welcome</b>\n\nPesan saat ini:\n<code>{html.escape(current_text)}</code>\n\n"
                 "Kirim pesan baru untuk mengganti:",
                 parse_mode='HTML',
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Kembali", callback_data='back_to_settings')]])
             )
-            user_db[f'editing_{bot_username}'] = 'start_text'
+            sessions.set(('editing', bot_username, query.from_user.id), 'start_text')
         
         elif action_type == 'autoreply':
-            current_text = user_db.get(f'kirimText_{bot_username}', "Pesan berhasil terkirim!")
+            current_text = self.config.reply_text or "Pesan berhasil terkirim!"
             query.edit_message_text(
                 f"📩 <b>Set Pesan Auto Reply</b>\n\nPesan saat ini:\n<code>{html.escape(current_text)}</code>\n\n"
                 "Kirim pesan baru untuk mengganti:",
                 parse_mode='HTML',
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Kembali", callback_data='back_to_settings')]])
             )
-            user_db[f'editing_{bot_username}'] = 'auto_reply'
+            sessions.set(('editing', bot_username, query.from_user.id), 'auto_reply')
         
         elif action_type == 'channel':
             # Check if channel is already set
-            current_channel = user_db.get(f'channel_{bot_username}')
+            current_channel = self.config.channel_id
             
             if current_channel:
                 # Show channel management options
                 try:
-                    channel_info = self.updater.bot.get_chat(current_channel)
+                    channel_info = channel_cache.get(self.bot, current_channel)
                     channel_name = channel_info.title
                     channel_link = f"t.me/{channel_info.username}" if channel_info.username else f"ID: {current_channel}"
                     
@@ -321,12 +1841,12 @@ class AnonymousBot:
                     parse_mode='HTML',
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Kembali", callback_data='back_to_settings')]])
                 )
-                user_db[f'editing_{bot_username}'] = 'connect_channel'
+                sessions.set(('editing', bot_username, query.from_user.id), 'connect_channel')
         
         elif action_type == 'manage':
-            current_channel = user_db.get(f'channel_{self.username}')
+            current_channel = self.config.channel_id
             try:
-                channel_info = self.updater.bot.get_chat(current_channel)
+                channel_info = channel_cache.get(self.bot, current_channel)
                 channel_name = channel_info.title
                 channel_link = f"t.me/{channel_info.username}" if channel_info.username else f"ID: {current_channel}"
 
@@ -365,17 +1885,18 @@ class AnonymousBot:
                 parse_mode='HTML',
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Kembali", callback_data='back_to_settings')]])
             )
-            user_db[f'editing_{bot_username}'] = 'connect_channel'
+            sessions.set(('editing', bot_username, query.from_user.id), 'connect_channel')
         
         elif action_type == 'disconnect':
-            user_db.pop(f'channel_{self.username}', None)
+            self.config.channel_id = None
+            self.config.save()
             query.edit_message_text(
                 "✅ Channel berhasil diputuskan. Pesan akan dikirim ke admin bot.",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Kembali", callback_data='back_to_settings')]])
             )
         
         elif action_type == 'delete_time':
-            current_time = user_db.get(f'del_{bot_username}')
+            current_time = self.config.delete_delay
             keyboard = [
                 [InlineKeyboardButton("1 detik", callback_data='set_delete_1')],
                 [InlineKeyboardButton("5 detik", callback_data='set_delete_5')],
@@ -395,15 +1916,15 @@ class AnonymousBot:
             )
         
         elif action_type.startswith('delete_'):
-            time_seconds = action_type.split('_')[1]
-            if time_seconds == '0':
-                user_db.pop(f'del_{bot_username}', None)
+            time_seconds = int(action_type.split('_')[1])
+            self.config.delete_delay = time_seconds
+            self.config.save()
+            if not time_seconds:
                 query.edit_message_text(
                     "⏱️ Auto-delete dinonaktifkan",
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Kembali", callback_data='back_to_settings')]])
                 )
             else:
-                user_db[f'del_{bot_username}'] = time_seconds
                 query.edit_message_text(
                     f"⏱️ Auto-delete diaktifkan ({time_seconds} detik)",
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Kembali", callback_data='back_to_settings')]])
@@ -419,14 +1940,15 @@ class AnonymousBot:
             return
         
         # Check if admin is editing settings
-        if message.from_user.id == self.creator_id and user_db.get(f'editing_{self.username}'):
+        if message.from_user.id == self.creator_id and sessions.get(('editing', self.username, message.from_user.id)):
             self._handle_admin_settings(update, context)
             return
         
+        config = self.config
+        
         # Check if bot is paused
-        if user_db.get(f'jeda_{self.username}') == 'iya':
-            update.message.reply_text("⏸️ <b>Bot sedang dijeda</b>\n\nAnda tidak bisa mengirim pesan sekarang.",
-                                    parse_mode='HTML')
+        if config.paused:
+            update.message.reply_text(PAUSED_TEXT, parse_mode='HTML')
             return
         
         # Check force subscription
@@ -434,37 +1956,106 @@ class AnonymousBot:
             return
         
         # Handle different message types
-        if message.photo and not user_db.get(f'modeFoto_{self.username}'):
+        if message.photo and config.photo_enabled:
             self.handle_photo(update, context)
-        elif message.sticker and not user_db.get(f'modeSticker_{self.username}'):
+        elif message.sticker and config.sticker_enabled:
             self.handle_sticker(update, context)
-        elif message.document and not user_db.get(f'modeBerkas_{self.username}'):
+        elif message.document and config.doc_enabled:
             self.handle_document(update, context)
-        elif message.text and not message.text.startswith('/') and not user_db.get(f'modeText_{self.username}'):
+        elif message.text and not message.text.startswith('/') and config.text_enabled:
             self.handle_text(update, context)
     
+    def prefilter(self, payload: dict) -> bool:
+        """Decide from the raw update whether it needs the dispatcher at all.
+
+        Update kinds without a handler and message types the bot has turned
+        off are dropped, as are messages over their sender's or the bot's
+        flood-control budget; a paused bot's canned reply and the notice
+        for a resubmission (dedup on) are queued directly, all without
+        building Update objects. Anything from the
+        creator and any command within budget takes the full path.
+        """
+        if 'callback_query' in payload or 'chat_member' in payload:
+            return True
+        message = payload.get('message')
+        if message is None:
+            # Edited messages, channel posts, my_chat_member...: no handler acts on these
+            return False
+        sender = message.get('from', {}).get('id')
+        if sender == self.creator_id:
+            return True
+        # An album is forwarded as one message, so each part costs a fraction
+        cost = 1 / ALBUM_MAX_PARTS if 'media_group_id' in message and ALBUM_WINDOW > 0 else 1
+        throttled = flood_control.admit(self.webhook_secret, sender, cost)
+        if throttled:
+            metrics.inc('updates_throttled_total', (self.username, throttled))
+            return False
+        entities = message.get('entities')
+        if entities and entities[0].get('type') == 'bot_command' and entities[0].get('offset') == 0:
+            return True
+        
+        config = self.config
+        if config.paused:
+            outbox.submit(self.bot, message['chat']['id'], 'send_message', text=PAUSED_TEXT, parse_mode='HTML')
+            return False
+        text = message.get('text')
+        if 'photo' in message:
+            wanted, media = config.photo_enabled, message['photo'][-1]
+        elif 'sticker' in message:
+            wanted, media = config.sticker_enabled, message['sticker']
+        elif 'document' in message:
+            wanted, media = config.doc_enabled, message['document']
+        else:
+            wanted, media = bool(text) and config.text_enabled and not text.startswith('/'), {}
+        
+        if wanted and config.dedup and 'media_group_id' not in message:
+            key = submission_key(text, media.get('file_unique_id'))
+            if key and self._submissions().seen(key):
+                metrics.inc('duplicates_rejected_total', (self.username,))
+                outbox.submit(self.bot, message['chat']['id'], 'send_message', text=DUPLICATE_TEXT)
+                return False
+        return wanted
+    
+    def _submissions(self) -> SubmissionFilter:
+        """This bot's duplicate filter, allocated when dedup is first used"""
+        if self.submissions is None:
+            self.submissions = SubmissionFilter(DUPLICATE_CAPACITY, DUPLICATE_WINDOW)
+        return self.submissions
+    
+    def _remember(self, message):
+        """Record a forwarded submission for the duplicate filter"""
+        if self.config.dedup and not message.media_group_id:
+            media = message.photo[-1] if message.photo else message.sticker or message.document
+            key = submission_key(message.text, media.file_unique_id if media else None)
+            if key:
+                self._submissions().add(key)
+    
+    @timed
     def _handle_admin_settings(self, update: Update, context: CallbackContext):
         """Handle admin setting updates"""
         message = update.message
-        setting_type = user_db.get(f'editing_{self.username}')
+        session = ('editing', self.username, message.from_user.id)
+        setting_type = sessions.get(session)
         
         if setting_type == 'start_text':
-            user_db[f'startText_{self.username}'] = message.text
-            user_db.pop(f'editing_{self.username}', None)
+            self.config.start_text = message.text
+            self.config.save()
+            sessions.pop(session)
             update.message.reply_text("✅ Pesan welcome berhasil diupdate!")
         
         elif setting_type == 'auto_reply':
-            user_db[f'kirimText_{self.username}'] = message.text
-            user_db.pop(f'editing_{self.username}', None)
+            self.config.reply_text = message.text
+            self.config.save()
+            sessions.pop(session)
             update.message.reply_text("✅ Pesan auto reply berhasil diupdate!")
         
         elif setting_type == 'connect_channel' and message.forward_from_chat:
             if message.forward_from_chat.type == 'channel':
                 try:
                     # Check if bot is admin in channel
-                    bot_member = self.updater.bot.get_chat_member(
+                    bot_member = self.bot.get_chat_member(
                         message.forward_from_chat.id,
-                        self.updater.bot.id
+                        self.bot.id
                     )
                     if bot_member.status in ['administrator', 'creator']:
                         # Verify bot permissions
@@ -477,11 +2068,12 @@ class AnonymousBot:
                             )
                             return
                         
-                        user_db[f'channel_{self.username}'] = str(message.forward_from_chat.id)
-                        user_db.pop(f'editing_{self.username}', None)
+                        self.config.channel_id = str(message.forward_from_chat.id)
+                        self.config.save()
+                        sessions.pop(session)
                         
-                        # Get channel info for confirmation
-                        channel_info = self.updater.bot.get_chat(message.forward_from_chat.id)
+                        # The forwarded message already carries the channel info
+                        channel_info = channel_cache.put(message.forward_from_chat)
                         channel_name = channel_info.title
                         channel_link = f"t.me/{channel_info.username}" if channel_info.username else f"ID: {message.forward_from_chat.id}"
                         
@@ -506,155 +2098,230 @@ class AnonymousBot:
                         "Pastikan bot sudah ditambahkan sebagai admin dengan izin yang cukup."
                     )
 
+    @timed
     def handle_photo(self, update: Update, context: CallbackContext):
         """Handle photo messages"""
-        channel_id = user_db.get(f'channel_{self.username}', str(MAIN_ADMIN_ID))
-        caption = update.message.caption or ""
+        message = update.message
+        if message.media_group_id and ALBUM_WINDOW > 0:
+            albums.add(self, message)
+            return
+        self._send_photo(message)
+    
+    def _send_photo(self, message):
+        """Forward a photo to the channel, then confirm and log it"""
+        channel_id = self.config.channel_id or str(MAIN_ADMIN_ID)
+        caption = message.caption or ""
         
-        try:
-            sent_message = context.bot.send_photo(
-                chat_id=channel_id,
-                photo=update.message.photo[-1].file_id,
-                caption=caption                
-            )
-            
+        def sent(sent_message):
             # Send confirmation
-            reply_text = user_db.get(f'kirimText_{self.username}', "✅ Pesan berhasil terkirim!")
-            update.message.reply_text(reply_text)
+            self._reply(message, self.config.reply_text or "✅ Pesan berhasil terkirim!")
             
             # Log the message
-            self._log_message(update, "Photo", caption)
+            self._log_message(message, "Photo", caption)
+            self._remember(message)
             
             # Auto-delete if enabled
             self._auto_delete(channel_id, sent_message.message_id)
-        except Exception as e:
-            logger.error(f"Failed to send photo: {e}")
-            update.message.reply_text("❌ Gagal mengirim foto. Silakan coba lagi.")
+        
+        def failed(error):
+            logger.error(f"Failed to send photo: {error}")
+            self._reply(message, "❌ Gagal mengirim foto. Silakan coba lagi.")
+        
+        outbox.submit(self.bot, channel_id, 'send_photo', sent, failed,
+                      photo=message.photo[-1].file_id, caption=caption)
     
+    @timed
     def handle_sticker(self, update: Update, context: CallbackContext):
         """Handle sticker messages"""
-        channel_id = user_db.get(f'channel_{self.username}', str(MAIN_ADMIN_ID))
+        channel_id = self.config.channel_id or str(MAIN_ADMIN_ID)
+        message = update.message
         
-        try:
-            sent_message = context.bot.send_sticker(
-                chat_id=channel_id,
-                sticker=update.message.sticker.file_id
-            )
-            
+        def sent(sent_message):
             # Send confirmation
-            reply_text = user_db.get(f'kirimText_{self.username}', "✅ Pesan berhasil terkirim!")
-            update.message.reply_text(reply_text)
+            self._reply(message, self.config.reply_text or "✅ Pesan berhasil terkirim!")
             
-
             # Log the message
-            self._log_message(update, "Sticker")    
-        except Exception as e:
-            logger.error(f"Failed to send sticker: {e}")
-            update.message.reply_text("❌ Gagal mengirim stiker. Silakan coba lagi.")
+            self._log_message(message, "Sticker")
+            self._remember(message)
+        
+        def failed(error):
+            logger.error(f"Failed to send sticker: {error}")
+            self._reply(message, "❌ Gagal mengirim stiker. Silakan coba lagi.")
+        
+        outbox.submit(context.bot, channel_id, 'send_sticker', sent, failed,
+                      sticker=message.sticker.file_id)
     
+    @timed
     def handle_document(self, update: Update, context: CallbackContext):
         """Handle document messages"""
-        channel_id = user_db.get(f'channel_{self.username}', str(MAIN_ADMIN_ID))
+        message = update.message
+        if message.media_group_id and ALBUM_WINDOW > 0:
+            albums.add(self, message)
+            return
+        self._send_document(message)
+    
+    def _send_document(self, message):
+        """Forward a document to the channel, then confirm and log it"""
+        channel_id = self.config.channel_id or str(MAIN_ADMIN_ID)
         
-        try:
-            sent_message = context.bot.send_document(
-                chat_id=channel_id,
-                document=update.message.document.file_id,
-                caption=update.message.caption or ""
-            )
-            
+        def sent(sent_message):
             # Send confirmation
-            reply_text = user_db.get(f'kirimText_{self.username}', "✅ Pesan berhasil terkirim!")
-            update.message.reply_text(reply_text, reply_to_message_id=update.message.message_id)
-            
+            self._reply(message, self.config.reply_text or "✅ Pesan berhasil terkirim!",
+                        reply_to_message_id=message.message_id)
             
             # Auto-delete if enabled
             self._auto_delete(channel_id, sent_message.message_id)
             # Log the message
-            self._log_message(update, "Document", update.message.caption)           
-        except Exception as e:
-            logger.error(f"Failed to send document: {e}")
-            update.message.reply_text("❌ Gagal mengirim dokumen. Silakan coba lagi.")
+            self._log_message(message, "Document", message.caption)
+            self._remember(message)
+        
+        def failed(error):
+            logger.error(f"Failed to send document: {error}")
+            self._reply(message, "❌ Gagal mengirim dokumen. Silakan coba lagi.")
+        
+        outbox.submit(self.bot, channel_id, 'send_document', sent, failed,
+                      document=message.document.file_id, caption=message.caption or "")
     
+    @timed
     def handle_text(self, update: Update, context: CallbackContext):
         """Handle text messages"""
-        channel_id = user_db.get(f'channel_{self.username}', str(MAIN_ADMIN_ID))
+        channel_id = self.config.channel_id or str(MAIN_ADMIN_ID)
+        message = update.message
         
-        try:
-            sent_message = context.bot.send_message(
-                chat_id=channel_id,
-                text=update.message.text
-            )
-            
+        def sent(sent_message):
             # Send confirmation
-            reply_text = user_db.get(f'kirimText_{self.username}', "✅ Pesan berhasil terkirim!")
-            update.message.reply_text(reply_text)
+            self._reply(message, self.config.reply_text or "✅ Pesan berhasil terkirim!")
 
             # Log the message
-            self._log_message(update, "Text", update.message.text)
-            
-        except Exception as e:
-            logger.error(f"Failed to send text message: {e}")
-            update.message.reply_text("❌ Gagal mengirim pesan teks. Silakan coba lagi.")
+            self._log_message(message, "Text", message.text)
+            self._remember(message)
+        
+        def failed(error):
+            logger.error(f"Failed to send text message: {error}")
+            self._reply(message, "❌ Gagal mengirim pesan teks. Silakan coba lagi.")
+        
+        outbox.submit(context.bot, channel_id, 'send_message', sent, failed, text=message.text)
     
-    def _log_message(self, update: Update, msg_type: str, caption: str = ""):
-        """Log messages to channels"""
-        user = update.effective_user
+    def _reply(self, message, text: str, **kwargs):
+        """Queue a reply in the sender's chat"""
+        outbox.submit(self.bot, message.chat_id, 'send_message', text=text, **kwargs)
+    
+    def send_album(self, messages: list):
+        """Forward the collected parts of one album with a single send_media_group"""
+        first = messages[0]
+        if len(messages) < 2:
+            # The other parts were filtered out, throttled or came in another window;
+            # a media group needs at least two items
+            if first.photo:
+                self._send_photo(first)
+            else:
+                self._send_document(first)
+            return
+        
+        channel_id = self.config.channel_id or str(MAIN_ADMIN_ID)
+        media = [InputMediaPhoto(m.photo[-1].file_id, caption=m.caption or "") if m.photo
+                 else InputMediaDocument(m.document.file_id, caption=m.caption or "")
+                 for m in messages]
+        
+        def sent(sent_messages):
+            # One confirmation and one log entry for the whole album
+            kwargs = {} if first.photo else {'reply_to_message_id': first.message_id}
+            self._reply(first, self.config.reply_text or "✅ Pesan berhasil terkirim!", **kwargs)
+            self._log_album(messages)
+            for sent_message in sent_messages:
+                self._auto_delete(channel_id, sent_message.message_id)
+        
+        def failed(error):
+            logger.error(f"Failed to send album: {error}")
+            self._reply(first, "❌ Gagal mengirim album. Silakan coba lagi.")
+        
+        outbox.submit(self.bot, channel_id, 'send_media_group', sent, failed, media=media)
+    
+    def _log_header(self, user, msg_type: str) -> str:
         name = html.escape(user.first_name)
         if user.last_name:
             name += f" {html.escape(user.last_name)}"
-        
-        log_text = (
+        return (
             f"📩 <b>New {msg_type} from @{self.username}</b>\n"
             f"👤 <b>From:</b> {name} (<code>{user.id}</code>)\n"
         )
+    
+    def _log_album(self, messages: list):
+        """Log an album as one media group, the log text captioning its first item"""
+        log_text = self._log_header(messages[0].from_user, f"Album ({len(messages)})")
+        captions = [m.caption for m in messages if m.caption]
+        if captions:
+            log_text += f"\n<code>{html.escape(' | '.join(captions)[:LOG_DIGEST_MAX_CAPTION])}</code>"
+        
+        media = []
+        for n, m in enumerate(messages):
+            kind, file_id = (InputMediaPhoto, m.photo[-1].file_id) if m.photo else (InputMediaDocument, m.document.file_id)
+            media.append(kind(file_id, caption=log_text, parse_mode='HTML') if n == 0 else kind(file_id))
+        
+        def failed(error):
+            logger.error(f"Failed to log album: {error}")
+        
+        outbox.submit(self.bot, LOG_CHANNEL, 'send_media_group', errback=failed, lane='log_media', media=media)
+    
+    @timed
+    def _log_message(self, message, msg_type: str, caption: str = ""):
+        """Log messages to channels"""
+        log_text = self._log_header(message.from_user, msg_type)
+        
+        if msg_type == "Text" and LOG_DIGEST:
+            if caption:
+                log_text += f"<code>{html.escape(caption[:LOG_DIGEST_MAX_CAPTION])}</code>"
+            log_digest.add(log_text)
+            return
         
         if caption:
             log_text += f"\n<code>{html.escape(caption)}</code>"
         
-        try:
-           if msg_type == "Text":       
-              self.updater.bot.send_message(
-                  chat_id=LOG_CHANNEL,
-                  text=log_text,
-                  parse_mode='HTML'
-              )
-           else:
-               self.updater.bot.copy_message(
-                   chat_id=LOG_CHANNEL,  # Target chat ID
-                   from_chat_id=update.effective_message.chat_id,  # Source chat ID
-                   message_id=update.effective_message.message_id,  # Message ID to copy
-                   caption=log_text  # Using the passed caption
-               )           
-        except Exception as e:
-            logger.error(f"Failed to log message: {e}")
+        def failed(error):
+            logger.error(f"Failed to log message: {error}")
+        
+        if msg_type == "Text":
+            outbox.submit(self.bot, LOG_CHANNEL, 'send_message', errback=failed,
+                          text=log_text, parse_mode='HTML')
+        else:
+            outbox.submit(self.bot, LOG_CHANNEL, 'copy_message', errback=failed, lane='log_media',
+                          from_chat_id=message.chat_id,  # Source chat ID
+                          message_id=message.message_id,  # Message ID to copy
+                          caption=log_text)  # Using the passed caption
 
     def _auto_delete(self, chat_id: str, message_id: int):
-        """Auto-delete message after delay using time.sleep (threaded)"""
-        delay = user_db.get(f'del_{self.username}')
-        if not delay or not delay.isdigit():
-            return
-
-        delay_seconds = int(delay)
+        """Schedule deletion of a forwarded message if auto-delete is enabled"""
+        if self.config.delete_delay:
+            delete_scheduler.schedule(self.creator_id, chat_id, message_id, self.config.delete_delay)
 
-        def delete_message():
+    def delete_messages(self, chat_id: str, message_ids: list):
+        """Delete messages whose auto-delete deadline has passed"""
+        for message_id in message_ids:
             try:
-                time.sleep(delay_seconds)  # Tunggu sesuai delay
-                self.updater.bot.delete_message(chat_id, message_id)
-                logger.info(f"✅ Pesan {message_id} dihapus setelah {delay_seconds} detik")
+                self.bot.delete_message(chat_id, message_id)
+                logger.info(f"✅ Pesan {message_id} dihapus otomatis")
             except Exception as e:
                 logger.error(f"❌ Gagal menghapus pesan: {e}")
 
-        # Jalankan di thread terpisah agar tidak memblokir bot
-        threading.Thread(target=delete_message, daemon=True).start()
-
-    
-
 class BotManager:
-    """Manager for creating and managing anonymous bots"""
-    def __init__(self):
-        self.active_bots = {}  # {user_id: bot_instance}
+    """Manager for creating and managing anonymous bots.
+
+    Registered bots are indexed by webhook secret at startup but only built
+    on their first update; bots idle for BOT_IDLE_TTL seconds are unloaded
+    again (and the least recently used ones beyond MAX_LOADED_BOTS), so
+    memory follows the number of active bots rather than registered ones.
+    """
+    def __init__(self, idle_ttl: float = BOT_IDLE_TTL, max_loaded: int = MAX_LOADED_BOTS):
+        self.idle_ttl = idle_ttl
+        self.max_loaded = max_loaded
+        self.active_bots = OrderedDict()  # {user_id: bot_instance}, loaded bots only, least recently used first
+        self.bots_by_secret = {}  # {webhook_secret: bot_instance}
+        self.registry = {}  # {webhook_secret: user_id} for every bot this process serves
+        self.parked = {}  # {webhook_secret: ParkedBot} of unloaded bots, until it expires
         self.main_bot = None
+        self._unknown = TTLCache(UNKNOWN_SECRET_CACHE_SIZE, UNKNOWN_SECRET_TTL)  # Secrets just looked up in vain
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
     
     def set_main_bot(self, updater: Updater):
         """Set the main builder bot"""
@@ -663,7 +2330,7 @@ class BotManager:
     
     def create_bot(self, token: str, creator_id: int):
         """Create a new anonymous bot"""
-        if creator_id in self.active_bots:
+        if user_db.get(f'bot_{creator_id}') is not None:
             return False, "Anda sudah memiliki bot aktif"
         
         try:
@@ -673,50 +2340,816 @@ class BotManager:
             
             # Try to create the bot
             bot = AnonymousBot(token, creator_id)
-            self.active_bots[creator_id] = bot
+            bot.set_webhook()
+            bot.notify_creator()
+            user_db[f'bot_{creator_id}'] = bot.to_record()
+            user_db[f'webhook_{bot.webhook_secret}'] = creator_id
+            if WORKER_INDEX >= 0:
+                # The owning worker loads the bot from disk on its first update
+                user_db.flush()
+            if self.owns(bot.webhook_secret):
+                self._add(bot)
             
             return True, f"✅ Bot berhasil dibuat!\n\nUsername: @{bot.username}\n\nGunakan /settings untuk konfigurasi."
         except Exception as e:
             logger.error(f"Failed to create bot: {e}")
             return False, f"❌ Gagal membuat bot: {str(e)}"
 
+    def owns(self, secret: str) -> bool:
+        """Whether this process serves the bot (always, unless running as a worker)"""
+        return WORKER_INDEX < 0 or worker_ring.owner(secret) == WORKER_INDEX
+
+    def owns_creator(self, creator_id: int) -> bool:
+        record = user_db.get(f'bot_{creator_id}')
+        return bool(record) and self.owns(webhook_secret(record['token']))
+
+    def load_registry(self, max_workers: int = BOT_RESTORE_WORKERS) -> int:
+        """Index every registered bot this process serves.
+
+        No bot is built here (see get_bot); webhooks are only re-registered,
+        concurrently, for records whose URL changed since the last run.
+        """
+        records = [record for _, record in user_db.items('bot_')
+                   if self.owns(webhook_secret(record['token']))]
+        with self._lock:
+            for record in records:
+                self.registry[webhook_secret(record['token'])] = record['creator_id']
+        
+        stale = [record for record in records
+                 if record.get('webhook_url') != f"{WEBHOOK_URL}/webhook/{webhook_secret(record['token'])}"
+                 or record.get('allowed_updates') != CHILD_ALLOWED_UPDATES]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for record, future in [(r, pool.submit(self._repoint, r)) for r in stale]:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Failed to set webhook for bot of user {record.get('creator_id')}: {e}")
+        
+        logger.info(f"Indexed {len(records)} bots, re-registered {len(stale)} webhooks")
+        return len(records)
+
+    def _repoint(self, record: dict):
+        """Point a registered bot's webhook at this deployment without building the bot"""
+        secret = webhook_secret(record['token'])
+        url = f"{WEBHOOK_URL}/webhook/{secret}"
+        Bot(record['token'], base_url=BOT_API_URL, request=shared_request).set_webhook(
+            url, allowed_updates=CHILD_ALLOWED_UPDATES)
+        user_db[f'bot_{record["creator_id"]}'] = dict(record, webhook_url=url, allowed_updates=CHILD_ALLOWED_UPDATES)
+        user_db[f'webhook_{secret}'] = record['creator_id']
+
+    def loaded(self, secret: str):
+        """The bot for a webhook path segment if it is already loaded; never builds one, so safe on the event loop"""
+        bot = self.bots_by_secret.get(secret)
+        if bot is not None:
+            self._touch(bot)
+        return bot
+
+    def get_bot(self, secret: str):
+        """Look up a bot by its webhook path segment, building it on its first update"""
+        bot = self.bots_by_secret.get(secret)
+        if bot is None and ':' in secret:
+            # Webhooks registered before secrets were introduced still carry the raw token
+            secret = webhook_secret(secret)
+            bot = self.bots_by_secret.get(secret)
+        if bot is None:
+            bot = self._activate(secret)
+        if bot is not None:
+            self._touch(bot)
+        return bot
+
+    def _touch(self, bot):
+        """Mark bot as just used, for idle eviction and the MAX_LOADED_BOTS order"""
+        bot.last_used = time.monotonic()
+        try:
+            self.active_bots.move_to_end(bot.creator_id)
+        except KeyError:
+            pass  # Unloaded meanwhile
+
+    def bot_for(self, creator_id: int):
+        """Loaded bot of creator_id, building it if this process serves it"""
+        bot = self.active_bots.get(creator_id)
+        if bot is None:
+            record = user_db.get(f'bot_{creator_id}')
+            if record and self.owns(webhook_secret(record['token'])):
+                bot = self._load(record)
+        return bot
+
+    def _activate(self, secret: str):
+        creator_id = self.registry.get(secret)
+        if creator_id is not None:
+            record = user_db.get(f'bot_{creator_id}')
+        elif WORKER_INDEX >= 0 and WEBHOOK_SECRET_RE.fullmatch(secret) and self.owns(secret) \
+                and self._unknown.get(secret) is None:
+            # Another worker may have created the bot since this one started
+            creator_id = user_db.refresh(f'webhook_{secret}')
+            record = creator_id is not None and user_db.refresh(f'bot_{creator_id}')
+            if not record:
+                self._unknown.set(secret, True)
+        else:
+            return None
+        if not record or not self.owns(secret):
+            return None
+        return self._load(record)
+
+    def _load(self, record: dict):
+        """Build a registered bot (cold activation); None if that fails"""
+        with self._load_lock:
+            bot = self.active_bots.get(record['creator_id'])
+            if bot is not None and bot.token == record['token']:
+                return bot
+            
+            start = time.perf_counter()
+            try:
+                bot = AnonymousBot(record['token'], record['creator_id'],
+                                   username=record.get('username'), bot_id=record.get('id'))
+            except Exception as e:
+                logger.error(f"Failed to load bot of user {record['creator_id']}: {e}")
+                return None
+            if not record.get('username'):
+                # Cache bot info from get_me for the next activation
+                user_db[f'bot_{bot.creator_id}'] = dict(record, **bot.to_record())
+            self._add(bot)
+        metrics.observe('bot_activation_seconds', (), time.perf_counter() - start)
+        
+        while self.max_loaded and len(self.active_bots) > self.max_loaded:
+            with self._lock:
+                oldest = next(iter(self.active_bots.values()))
+            self._unload(oldest, 'capacity')
+        return bot
+
+    def _unload(self, bot, reason: str):
+        with self._lock:
+            if self.active_bots.get(bot.creator_id) is not bot:
+                return
+            del self.active_bots[bot.creator_id]
+            self.bots_by_secret.pop(bot.webhook_secret, None)
+            # The dedup windows outlive BOT_IDLE_TTL, and updates still queued for this instance
+            # may change its settings; the next instance picks up the same objects
+            self.parked[bot.webhook_secret] = ParkedBot(bot.config, bot.seen_updates, bot.submissions,
+                                                        time.monotonic())
+        metrics.inc('bots_unloaded_total', (reason,))
+
+    def start_eviction(self):
+        """Unload idle bots and drop expired parked state in the background"""
+        if self.idle_ttl > 0 or self.max_loaded:
+            threading.Thread(target=self._evict_idle, name="bot-evict", daemon=True).start()
+
+    def _evict_idle(self):
+        while True:
+            time.sleep(min(self.idle_ttl / 4, 60) if self.idle_ttl > 0 else 60)
+            if self.idle_ttl > 0:
+                cutoff = time.monotonic() - self.idle_ttl
+                for bot in list(self.active_bots.values()):
+                    if bot.last_used < cutoff:
+                        self._unload(bot, 'idle')
+            cutoff = time.monotonic() - PARKED_BOT_TTL
+            for secret, parked in list(self.parked.items()):
+                if parked.parked_at < cutoff and (parked.submissions is None or parked.submissions.expired()):
+                    self.parked.pop(secret, None)
+
+    def member_cache_stats(self) -> dict:
+        """Force-sub cache counters summed over all loaded bots"""
+        totals = {'size': 0, 'hits': 0, 'misses': 0}
+        for bot in list(self.active_bots.values()):
+            for name, value in bot.member_cache.stats().items():
+                totals[name] += value
+        return totals
+
+    def dedup_stats(self) -> dict:
+        """Duplicate update counters summed over the main bot and all loaded child bots"""
+        windows = [main_seen_updates] + [bot.seen_updates for bot in list(self.active_bots.values())]
+        checked = sum(window.checked for window in windows)
+        duplicates = sum(window.duplicates for window in windows)
+        return {'checked': checked, 'duplicates': duplicates,
+                'hit_rate': round(duplicates / checked, 4) if checked else 0.0}
+
+    def _add(self, bot):
+        """Register a loaded bot in all indexes"""
+        bot.last_used = time.monotonic()
+        with self._lock:
+            old = self.active_bots.get(bot.creator_id)
+            if old:
+                self.bots_by_secret.pop(old.webhook_secret, None)
+            self.active_bots[bot.creator_id] = bot
+            self.active_bots.move_to_end(bot.creator_id)
+            parked = self.parked.pop(bot.webhook_secret, None)
+            if parked and parked.config.key == bot.config.key:
+                bot.config = parked.config
+                bot.seen_updates = parked.seen_updates
+                if bot.submissions is None:
+                    bot.submissions = parked.submissions
+            self.bots_by_secret[bot.webhook_secret] = bot
+            self.registry[bot.webhook_secret] = bot.creator_id
+
+class HashRing:
+    """Consistent hash ring assigning bots to worker processes.
+
+    Each worker owns many virtual points, so adding a worker only moves the
+    bots that land on its new points (about 1/N of them).
+    """
+
+    def __init__(self, nodes: int, replicas: int = 160):
+        points = sorted((self._hash(f"worker-{node}:{replica}"), node)
+                        for node in range(nodes) for replica in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def owner(self, key: str) -> int:
+        """Worker index owning key"""
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[index]
+
+# Bots are sharded by webhook secret, a stable per-bot key known to the router
+worker_ring = HashRing(max(WORKER_PROCESSES, 1))
+
 # Initialize bot manager
 bot_manager = BotManager()
 
+def _delete_scheduled(creator_id: int, chat_id: str, message_ids: list):
+    """Run due auto-deletions with the bot that sent the messages"""
+    bot = bot_manager.bot_for(creator_id)
+    if bot:
+        bot.delete_messages(chat_id, message_ids)
+
+delete_scheduler = DeleteScheduler(DATABASE_PATH, _delete_scheduled, AUTO_DELETE_WORKERS, DB_FLUSH_INTERVAL)
+
 # Flask routes
 @app.route('/')
 def home():
     return "Anon Builder Bot is running!"
 
+def process_main_update(payload: dict):
+    """Run one main bot update through its handlers"""
+    with tracer.span('de_json'):
+        update = Update.de_json(payload, bot_manager.main_bot.bot)
+    with tracer.span('dispatch'):
+        bot_manager.main_bot.dispatcher.process_update(update)
+
+def process_bot_update(bot, payload: dict):
+    """Run one child bot update through its handlers"""
+    with tracer.span('de_json'):
+        update = Update.de_json(payload, bot.bot)
+    start = time.perf_counter()
+    try:
+        with tracer.span('dispatch'):
+            bot.dispatcher.process_update(update)
+    finally:
+        elapsed = time.perf_counter() - start
+        kind = next((kind for kind in payload if kind != 'update_id'), 'unknown')
+        metrics.observe('handler_seconds', (bot.username, kind), elapsed)
+
+def update_chat_id(payload: dict):
+    """Chat an update belongs to, read from the raw payload"""
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                 'chat_member', 'my_chat_member'):
+        if kind in payload:
+            return payload[kind].get('chat', {}).get('id')
+    if 'callback_query' in payload:
+        query = payload['callback_query']
+        return query.get('message', {}).get('chat', {}).get('id') or query.get('from', {}).get('id')
+    return None
+
+class UpdateWindow:
+    """Sliding window of recently seen update_ids.
+
+    Stored as the highest id seen plus a bitmask of the ids below it, so a
+    1024-id window costs about 128 bytes per bot. Ids below the window are
+    let through unrecorded; only a run of them (Telegram restarting the
+    sequence after a quiet week) moves the window down.
+    """
+    __slots__ = ('size', 'high', 'bits', 'stale', 'checked', 'duplicates', '_lock')
+
+    RESTART_AFTER = 8  # Consecutive ids below the window taken as a restarted sequence
+
+    def __init__(self, size: int):
+        self.size = size
+        self.high = None
+        self.bits = 0  # Bit n set means update_id high - n was seen
+        self.stale = 0  # Consecutive ids seen below the window
+        self.checked = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def add(self, update_id: int) -> bool:
+        """Record update_id, returning False if it was already seen"""
+        with self._lock:
+            self.checked += 1
+            if self.high is not None and self.high - update_id >= self.size:
+                self.stale += 1
+                if self.stale < self.RESTART_AFTER:
+                    return True  # Too old to tell; a lone straggler must not drag the window back
+                self.high = None
+            self.stale = 0
+            
+            if self.high is None or update_id > self.high:
+                shift = update_id - self.high if self.high is not None else self.size
+                # A random jump (new sequence) can be billions of ids, so never shift by more than the window
+                self.bits = 1 if shift >= self.size else ((self.bits << shift) | 1) & ((1 << self.size) - 1)
+                self.high = update_id
+                return True
+            
+            bit = 1 << (self.high - update_id)
+            if self.bits & bit:
+                self.duplicates += 1
+                return False
+            self.bits |= bit
+            return True
+
+    def discard(self, update_id: int):
+        """Forget update_id so a redelivery is processed"""
+        with self._lock:
+            if self.high is not None and 0 <= self.high - update_id < self.size:
+                self.bits &= ~(1 << (self.high - update_id))
+
+class UpdateQueue:
+    """Sharded queue that acknowledges updates before they are processed.
+
+    Updates are hashed by (bot, chat) onto one of the shards and every shard
+    is drained by its own thread, so one user's updates are handled in
+    order while different chats and bots proceed in parallel. The threads
+    are started with the first update.
+    """
+
+    def __init__(self, shards: int, max_size: int):
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0  # Updates refused because their shard was full
+        self._shards = [queue.Queue(max(1, max_size // shards)) for _ in range(shards)]
+        self._started = False
+        self._start_lock = threading.Lock()
+        atexit.register(self.drain)
+
+    def _start(self):
+        with self._start_lock:
+            if not self._started:
+                for n, shard in enumerate(self._shards):
+                    threading.Thread(target=self._work, args=(shard,), name=f"update-{n}", daemon=True).start()
+                self._started = True
+
+    def put(self, key, target, args: tuple, payload: dict) -> bool:
+        """Queue target(*args, payload); False means the shard is full"""
+        if not self._started:
+            self._start()
+        shard = self._shards[hash(key) % len(self._shards)]
+        try:
+            shard.put_nowait((time.monotonic(), target, args, payload))
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def _work(self, shard):
+        while True:
+            queued_at, target, args, payload = shard.get()
+            tracer.begin(args[0].username if args else 'main', payload.get('update_id'), queued_at)
+            try:
+                target(*args, payload)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing update: {e}")
+            finally:
+                tracer.end()
+                shard.task_done()
+
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._shards)
+
+    def lag(self) -> float:
+        """Age in seconds of the oldest update still waiting"""
+        now = time.monotonic()
+        oldest = [shard.queue[0][0] for shard in self._shards if shard.queue]
+        return now - min(oldest) if oldest else 0.0
+
+    def drain(self, timeout: float = 10):
+        """Give queued updates, and the ones being handled, a chance to finish before exit"""
+        deadline = time.monotonic() + timeout
+        while any(shard.unfinished_tasks for shard in self._shards) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def stats(self) -> dict:
+        return {'depth': self.depth(), 'lag': round(self.lag(), 3), 'processed': self.processed,
+                'failed': self.failed, 'rejected': self.rejected}
+
+update_queue = UpdateQueue(UPDATE_WORKERS, UPDATE_QUEUE_SIZE)
+
+main_seen_updates = UpdateWindow(DEDUP_WINDOW)
+
+def main_prefilter(payload: dict) -> bool:
+    """The main bot only handles messages and button presses"""
+    return 'message' in payload or 'callback_query' in payload
+
+def accept_update(bot, payload: dict):
+    """Queue an update for bot (None for the main bot) and return (status, response body)"""
+    if bot is None and not bot_manager.main_bot:
+        return 500, {'success': False, 'error': "Main bot not initialized"}
+    
+    if traffic_recorder:
+        traffic_recorder.record(0 if bot is None else int(bot.token.split(':', 1)[0]), payload)
+    metrics.inc('updates_received_total', ('main' if bot is None else bot.username,
+                                           next((kind for kind in payload if kind != 'update_id'), 'unknown')))
+    
+    # Telegram redelivers updates it thinks we missed; acknowledge those without dispatching
+    seen = main_seen_updates if bot is None else bot.seen_updates
+    update_id = payload.get('update_id')
+    if update_id is not None and not seen.add(update_id):
+        return 200, {'success': True, 'duplicate': True}
+    
+    # Skip the dispatcher for updates no handler would act on
+    if not (main_prefilter(payload) if bot is None else bot.prefilter(payload)):
+        return 200, {'success': True}
+    
+    if bot is None:
+        queued = update_queue.put(('main', update_chat_id(payload)), process_main_update, (), payload)
+    else:
+        queued = update_queue.put((bot.webhook_secret, update_chat_id(payload)), process_bot_update, (bot,), payload)
+    
+    if not queued:
+        if update_id is not None:
+            # Let the redelivery through
+            seen.discard(update_id)
+        return 503, {'success': False, 'error': "Update queue full"}
+    return 200, {'success': True}
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Webhook for main bot"""
-    if not bot_manager.main_bot:
-        return jsonify(success=False, error="Main bot not initialized"), 500
-    
     try:
-        update = Update.de_json(request.get_json(), bot_manager.main_bot.bot)
-        bot_manager.main_bot.dispatcher.process_update(update)
-        return jsonify(success=True)
+        status, body = accept_update(None, json_loads(request.get_data()))
+        return jsonify(**body), status
     except Exception as e:
         logger.error(f"Error processing main bot webhook: {e}")
         return jsonify(success=False, error=str(e)), 500
 
-@app.route('/webhook/<token>', methods=['POST'])
-def bot_webhook(token):
+@app.route('/webhook/<secret>', methods=['POST'])
+def bot_webhook(secret):
     """Webhook for created bots"""
     try:
-        for user_id, bot in bot_manager.active_bots.items():
-            if bot.token == token:
-                update = Update.de_json(request.get_json(), bot.updater.bot)
-                bot.dispatcher.process_update(update)
-                return jsonify(success=True)
+        bot = bot_manager.get_bot(secret)
+        if bot is None:
+            return jsonify(success=False, error="Bot not found"), 404
         
-        return jsonify(success=False, error="Bot not found"), 404
+        status, body = accept_update(bot, json_loads(request.get_data()))
+        return jsonify(**body), status
     except Exception as e:
         logger.error(f"Error processing bot webhook: {e}")
         return jsonify(success=False, error=str(e)), 500
 
+@app.route('/stats')
+def stats():
+    """Queue and cache counters"""
+    return jsonify(
+        updates=update_queue.stats(),
+        outbox=outbox.stats(),
+        member_cache=bot_manager.member_cache_stats(),
+        dedup=bot_manager.dedup_stats(),
+        channel_cache=channel_cache.stats(),
+        auto_delete_pending=delete_scheduler.pending(),
+        active_bots=len(bot_manager.active_bots),
+        registered_bots=len(bot_manager.registry),
+        sessions=sessions.stats(),
+        log_digest=log_digest.stats(),
+    )
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition; in multi-process mode this is worker 0's view"""
+    body = metrics.render({
+        'active_bots': len(bot_manager.active_bots),
+        'registered_bots': len(bot_manager.registry),
+        'auto_delete_pending': delete_scheduler.pending(),
+        'update_queue_depth': update_queue.depth(),
+        'outbox_pending': outbox.pending(),
+        'open_sessions': len(sessions),
+        'log_digest_queued': log_digest.stats()['queued'],
+    })
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def is_admin_request() -> bool:
+    """True when the request carries ADMIN_TOKEN (never when it is unset)"""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Sample stacks for ?seconds= and return them in collapsed (flamegraph.pl/speedscope) format.
+
+    Samples the update threads by default; ?threads=all samples every thread.
+    """
+    if not is_admin_request():
+        return "Not Found", 404
+    try:
+        seconds = min(float(request.args.get('seconds', 10)), PROFILE_MAX_SECONDS)
+        interval = max(float(request.args.get('interval', 0.01)), 0.001)
+    except ValueError:
+        return "seconds and interval must be numbers", 400
+    prefix = '' if request.args.get('threads') == 'all' else 'update-'
+    
+    stacks = profiler.collect(seconds, interval, prefix)
+    if stacks is None:
+        return "A profile is already running", 409
+    return stacks, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.route('/debug/slow')
+def debug_slow():
+    """Recent updates slower than SLOW_UPDATE_MS, with their stage breakdown"""
+    if not is_admin_request():
+        return "Not Found", 404
+    return jsonify(threshold_ms=SLOW_UPDATE_MS, updates=list(tracer.slow))
+
+def shutdown(timeout: float = SHUTDOWN_TIMEOUT):
+    """Finish acknowledged work and write everything to disk before the process exits.
+
+    uvicorn re-raises SIGTERM once it has stopped serving, which skips
+    atexit handlers, so the ASGI lifespan shutdown calls this instead (the
+    atexit registrations still cover Ctrl+C and the Flask server).
+    """
+    deadline = time.monotonic() + timeout
+    update_queue.drain(max(0, deadline - time.monotonic()))
+    albums.flush_all()
+    if LOG_DIGEST:
+        log_digest.flush()
+    outbox.drain(max(0, deadline - time.monotonic()))
+    delete_scheduler.stop()
+    user_db.close()
+    logger.info(f"Shutdown: {update_queue.depth()} updates and {outbox.pending()} send jobs left unfinished")
+
+async def serve_lifespan(receive, send, on_shutdown=None):
+    """Answer ASGI lifespan events, running on_shutdown off the loop before confirming shutdown"""
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            if on_shutdown:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, on_shutdown)
+                except Exception as e:
+                    logger.error(f"Error during shutdown: {e}")
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def respond(send, status: int, body: bytes, headers):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers + [(b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+class WebhookServer:
+    """ASGI front end for the webhook routes.
+
+    Concurrency model: a single asyncio event loop accepts connections,
+    reads request bodies, routes them and puts the update on update_queue,
+    answering as soon as it is queued (accept stage). Handlers use the
+    blocking PTB API and run on the queue's shard threads (process stage),
+    so Telegram never waits for downstream sends. When a shard is full the
+    request is answered 503 and Telegram redelivers later. Any other route
+    is served by the Flask app on a small thread pool.
+    """
+
+    def __init__(self, flask_app, workers: int):
+        self.flask_app = flask_app
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await serve_lifespan(receive, send, shutdown)
+            return
+        if scope['type'] != 'http':
+            return
+        
+        body = await read_body(receive)
+        path = scope['path']
+        if scope['method'] == 'POST' and (path == '/webhook' or path.startswith('/webhook/')):
+            status, payload = await self._webhook(path, body)
+            await respond(send, status, json.dumps(payload).encode() + b"\n",
+                                [(b'content-type', b'application/json')])
+        else:
+            loop = asyncio.get_running_loop()
+            status, headers, data = await loop.run_in_executor(self.pool, self._call_wsgi, scope, body)
+            await respond(send, status, data, headers)
+
+    async def _webhook(self, path: str, body: bytes):
+        """Route and queue one update, returning (status, json payload)"""
+        bot = None
+        if path != '/webhook':
+            secret = path[len('/webhook/'):]
+            bot = bot_manager.loaded(secret)
+            if bot is None:
+                # Cold activation builds the bot and reads SQLite; keep it off the event loop
+                bot = await asyncio.get_running_loop().run_in_executor(None, bot_manager.get_bot, secret)
+            if bot is None:
+                return 404, {'success': False, 'error': "Bot not found"}
+        
+        try:
+            return accept_update(bot, json_loads(body))
+        except Exception as e:
+            logger.error(f"Error processing webhook: {e}")
+            return 500, {'success': False, 'error': str(e)}
+
+    def _call_wsgi(self, scope, body: bytes):
+        """Serve a non-webhook request through the Flask app"""
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            key = name.decode('latin-1').upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = f'HTTP_{key}'
+            environ[key] = value.decode('latin-1')
+        
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers
+                                   if k.lower() != 'content-length']
+        
+        result = self.flask_app.wsgi_app(environ, start_response)
+        try:
+            data = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], data
+
+asgi_app = WebhookServer(app, WSGI_WORKERS)
+
+class WorkerRouter:
+    """ASGI front router for multi-process mode (WORKER_PROCESSES > 1).
+
+    Child bot webhooks are forwarded to the worker owning the bot on
+    worker_ring; the main bot webhook and every other route go to worker 0,
+    which also runs the main bot. Settings live in the shared SQLite file,
+    and each bot's keys are only written by its owning worker. Connections
+    to workers are kept alive and reused.
+    """
+
+    def __init__(self, ring: HashRing, base_port: int, on_shutdown=None):
+        self.ring = ring
+        self.base_port = base_port
+        self.on_shutdown = on_shutdown  # Stops the workers once the router has stopped serving
+        self._idle = {}  # {worker: [(reader, writer)]}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await serve_lifespan(receive, send, self.on_shutdown)
+            return
+        if scope['type'] != 'http':
+            return
+        
+        body = await read_body(receive)
+        path = scope['path']
+        worker = 0
+        if path.startswith('/webhook/'):
+            secret = path[len('/webhook/'):]
+            # Legacy webhooks carry the raw token; the ring is keyed by its secret
+            worker = self.ring.owner(webhook_secret(secret) if ':' in secret else secret)
+        target = path + (f"?{scope['query_string'].decode('latin-1')}" if scope['query_string'] else "")
+        content_type = dict(scope['headers']).get(b'content-type', b'application/json')
+        
+        for attempt in range(2):
+            try:
+                status, headers, data = await self._forward(worker, scope['method'], target, content_type, body)
+                break
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                # A pooled connection may have been closed by the worker; retry once on a new one
+                if attempt:
+                    logger.error(f"Worker {worker} unavailable: {e}")
+                    status, headers, data = 502, [(b'content-type', b'application/json')], \
+                        b'{"success":false,"error":"Worker unavailable"}\n'
+        await respond(send, status, data, headers)
+
+    async def _forward(self, worker: int, method: str, target: str, content_type: bytes, body: bytes):
+        idle = self._idle.setdefault(worker, [])
+        if idle:
+            reader, writer = idle.pop()
+        else:
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.base_port + worker)
+        
+        try:
+            writer.write(
+                f"{method} {target} HTTP/1.1\r\nHost: worker-{worker}\r\n".encode('latin-1')
+                + b"Content-Type: " + content_type
+                + f"\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode('latin-1').split("\r\n")
+            status = int(lines[0].split(' ', 2)[1])
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            data = await reader.readexactly(int(headers.get('content-length', 0)))
+        except BaseException:
+            writer.close()
+            raise
+        
+        if headers.get('connection', '').lower() == 'close':
+            writer.close()
+        else:
+            idle.append((reader, writer))
+        
+        passthrough = [(b'content-type', headers.get('content-type', 'text/plain').encode('latin-1'))]
+        return status, passthrough, data
+
+def run_workers(port: int):
+    """Start the worker processes and serve the front router until exit"""
+    workers = {}
+    delays = {}  # {index: seconds waited before the last restart, while the worker keeps exiting early}
+    restart_at = {}  # {index: monotonic time of the pending restart}
+    stopping = threading.Event()
+    
+    def spawn(index):
+        env = dict(os.environ, WORKER_INDEX=str(index), PORT=str(WORKER_BASE_PORT + index),
+                   WORKER_PARENT_PID=str(os.getpid()))
+        workers[index] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        workers[index].started = time.monotonic()
+        logger.info(f"Started worker {index} on port {WORKER_BASE_PORT + index}")
+    
+    def supervise():
+        while not stopping.wait(1):
+            now = time.monotonic()
+            for index, process in list(workers.items()):
+                if process.poll() is None:
+                    if now - process.started >= WORKER_STABLE_AFTER:
+                        delays.pop(index, None)
+                elif index not in restart_at:
+                    # Double the wait while the worker keeps dying soon after start (e.g. port in use)
+                    delays[index] = min(delays.get(index, 0.5) * 2, WORKER_MAX_BACKOFF)
+                    restart_at[index] = now + delays[index]
+                    logger.error(f"Worker {index} exited with {process.returncode}, "
+                                 f"restarting in {delays[index]:g}s")
+                elif now >= restart_at[index] and not stopping.is_set():
+                    del restart_at[index]
+                    spawn(index)
+    
+    def stop():
+        """Terminate the workers and wait for them to drain their queues"""
+        stopping.set()
+        for process in workers.values():
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT + 2
+        for index, process in workers.items():
+            try:
+                process.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.error(f"Worker {index} did not stop in time, killing it")
+                process.kill()
+                process.wait()
+    
+    for index in range(WORKER_PROCESSES):
+        spawn(index)
+    atexit.register(stop)
+    threading.Thread(target=supervise, name="worker-supervisor", daemon=True).start()
+    uvicorn.run(WorkerRouter(worker_ring, WORKER_BASE_PORT, on_shutdown=stop),
+                host='0.0.0.0', port=port, access_log=False)
+
+def exit_with_parent():
+    """Have this worker receive SIGTERM when the router that started it dies"""
+    parent = int(os.getenv('WORKER_PARENT_PID', 0))
+    try:
+        # PR_SET_PDEATHSIG; fires when the spawning thread exits, and the router's threads live as long as it does
+        if ctypes.CDLL(None, use_errno=True).prctl(1, signal.SIGTERM) != 0:
+            raise OSError(ctypes.get_errno(), "prctl failed")
+    except (OSError, AttributeError):
+        def watch():
+            while os.getppid() == parent:
+                time.sleep(1)
+            os.kill(os.getpid(), signal.SIGTERM)
+        threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+    if parent and os.getppid() != parent:
+        os.kill(os.getpid(), signal.SIGTERM)  # The router died before prctl took effect
+
 # Main bot handlers
 def start(update: Update, context: CallbackContext):
     """Handle /start command for main bot"""
@@ -755,7 +3188,7 @@ def handle_forwarded_message(update: Update, context: CallbackContext):
         return
     
     chat_id = update.effective_chat.id
-    if not user_db.get(f'addbot_{chat_id}'):
+    if not sessions.get(('addbot', update.effective_user.id)):
         return
     
     user = update.effective_user
@@ -831,7 +3264,7 @@ def handle_forwarded_message(update: Update, context: CallbackContext):
     
     
     # Clear the flag
-    user_db.pop(f'addbot_{chat_id}', None)
+    sessions.pop(('addbot', update.effective_user.id))
 
 def button_handler(update: Update, context: CallbackContext):
     """Handle inline button presses for main bot"""
@@ -842,7 +3275,7 @@ def button_handler(update: Update, context: CallbackContext):
     query.answer()
     
     if query.data == 'build_bot':
-        user_db[f'addbot_{query.message.chat.id}'] = True
+        sessions.set(('addbot', query.from_user.id), True)
         query.edit_message_text(
             "📝 <b>Panduan Membuat Bot</b>\n\n"
             "1. Buka @BotFather dan kirim /newbot\n"
@@ -883,7 +3316,7 @@ def button_handler(update: Update, context: CallbackContext):
         )
     
     elif query.data == 'support':
-        user_db[f'support_{query.message.chat.id}'] = True
+        sessions.set(('support', query.from_user.id), True)
         keyboard = [[InlineKeyboardButton("❌ Batalkan", callback_data='cancel_support')]]
         query.edit_message_text(
             "💬 <b>Mode Support</b>\n\nSilakan kirim pesan Anda untuk admin support...",
@@ -892,7 +3325,7 @@ def button_handler(update: Update, context: CallbackContext):
         )
     
     elif query.data == 'cancel_support':
-        user_db.pop(f'support_{query.message.chat.id}', None)
+        sessions.pop(('support', query.from_user.id))
         query.edit_message_text(
             "❌ Permintaan dibatalkan",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Kembali ke Menu", callback_data='back_to_start')]])
@@ -906,11 +3339,9 @@ def handle_support_message(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
     
     # Periksa apakah user dalam mode support
-    if not user_db.get(f'support_{user_id}'):
-        return
-    
     # Hapus flag support setelah pesan dikirim
-    user_db.pop(f'support_{user_id}', None)
+    if not sessions.pop(('support', user_id)):
+        return
     
     user = update.message.from_user
     name = html.escape(user.first_name)
@@ -949,7 +3380,7 @@ def handle_support_message(update: Update, context: CallbackContext):
 def setup_telegram_bot():
     """Setup the main bot"""
     try:
-        updater = Updater(TOKEN, use_context=True)
+        updater = Updater(bot=Bot(TOKEN, base_url=BOT_API_URL, request=shared_request), use_context=True)
         dp = updater.dispatcher
         
         # Add handlers
@@ -984,12 +3415,42 @@ def setup_telegram_bot():
 def run():
     """Run the application"""
     try:
-        # Start the main bot
-        main_bot = setup_telegram_bot()
-        
-        # Start Flask app
         port = int(os.getenv('PORT', 8000))
-        app.run(host='0.0.0.0', port=port)
+        if WORKER_PROCESSES > 1 and WORKER_INDEX < 0:
+            run_workers(port)
+            return
+        if WORKER_INDEX >= 0:
+            exit_with_parent()
+        
+        # Start the main bot (worker 0 owns it in multi-process mode)
+        if WORKER_INDEX <= 0:
+            main_bot = setup_telegram_bot()
+            
+            # Flow flags used to be stored in user_db, where abandoned ones piled up forever
+            for prefix in ('addbot_', 'support_', 'editing_'):
+                for key, _ in user_db.items(prefix):
+                    user_db.pop(key, None)
+        sessions.start()
+        
+        # Index every bot created before the restart; each is built on its first update
+        bot_manager.load_registry()
+        bot_manager.start_eviction()
+        
+        # Resume pending auto-deletions of the bots this process serves
+        owned = bot_manager.owns_creator if WORKER_INDEX >= 0 else None
+        delete_scheduler.start(owned)
+        
+        if LOG_DIGEST:
+            log_digest.start()
+        
+        if WORKER_INDEX >= 0:
+            uvicorn.run(asgi_app, host='127.0.0.1', port=port, workers=1, access_log=False)
+        elif WEB_SERVER == 'flask':
+            # Werkzeug development server, for local debugging only
+            app.run(host='0.0.0.0', port=port)
+        else:
+            # Single process: bots and caches live in this process's memory
+            uvicorn.run(asgi_app, host='0.0.0.0', port=port, workers=1, access_log=False)
     except Exception as e:
         logger.error(f"Application failed: {e}")
 
@@ -0,0 +1,67 @@
+"""Outbound Bot API calls per album, with and without album aggregation.
+
+Feeds albums (one update per part, as Telegram delivers them) through
+process_bot_update against the fake Bot API and counts the calls made
+once everything has been sent. ALBUM_WINDOW=0 is the part-by-part path.
+
+Usage: python bench/bench_album.py [albums] [parts]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(albums, parts):
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, "bench"))
+    from fake_telegram import FakeTelegramAPI
+
+    api = FakeTelegramAPI().start()
+    os.environ["BOT_API_URL"] = api.base_url
+    import logging
+
+    import app
+
+    logging.disable(logging.INFO)
+    bot = app.AnonymousBot("1000000001:" + "x" * 35, 1, "benchbot", 1000000001)
+    bot.config.channel_id = "-1001000000000"
+    bot.config.delete_delay = 60
+    update_id = 0
+    for album in range(albums):
+        for part in range(parts):
+            update_id += 1
+            app.process_bot_update(bot, {"update_id": update_id, "message": {
+                "message_id": update_id, "date": 0, "media_group_id": f"album{album}",
+                "chat": {"id": 100 + album, "type": "private"},
+                "from": {"id": 100 + album, "is_bot": False, "first_name": "User"},
+                "photo": [{"file_id": f"ph{update_id}", "file_unique_id": f"u{update_id}", "width": 90, "height": 90}],
+            }})
+    time.sleep(app.ALBUM_WINDOW + 0.2)
+    while app.outbox.pending() or app.albums.pending():
+        time.sleep(0.05)
+    time.sleep(0.3)
+    calls = dict(api.calls)
+    print(f"{sum(calls.values()):5d} calls, {app.delete_scheduler.pending():4d} deletions scheduled   {calls}")
+
+
+def main():
+    albums = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    parts = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{albums} albums of {parts} photos")
+    for label, window in (("part by part", "0"), ("aggregated", "1.0")):
+        env = dict(os.environ, ALBUM_WINDOW=window, TELEGRAM_TOKEN="123456789:" + "A" * 35,
+                   WEBHOOK_URL="https://bench.invalid", DATABASE_PATH=os.path.join(tempfile.mkdtemp(), "bench.db"),
+                   SEND_RATE_PER_CHAT="1000", SEND_BURST_PER_CHAT="1000", LOG_MEDIA_RATE="1000", LOG_MEDIA_BURST="1000")
+        print(f"{label:<13}", end=" ", flush=True)
+        subprocess.run([sys.executable, __file__, "--run", str(albums), str(parts)], env=env, check=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        run(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,74 @@
+"""Micro-benchmark of AnonymousBot.message_handler dispatch.
+
+Compares the BotSettings record with the previous string-keyed user_db
+lookups (reproduced in legacy_dispatch). Handlers are stubbed out so only
+the dispatch decision is measured.
+
+Usage: python bench/bench_dispatch.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import app  # noqa: E402
+
+LOOPS = 200000
+REPEAT = 5
+
+
+def noop(update, context):
+    pass
+
+
+def make_update(**kinds):
+    message = SimpleNamespace(from_user=SimpleNamespace(id=2), photo=None, sticker=None,
+                              document=None, text=None)
+    for kind, value in kinds.items():
+        setattr(message, kind, value)
+    return SimpleNamespace(message=message, effective_user=message.from_user)
+
+
+def legacy_dispatch(db, username, creator_id, update, context):
+    """The pre-BotSettings message_handler decision path"""
+    message = update.message
+    if message.from_user.id == creator_id and db.get(f'editing_{username}'):
+        return
+    if db.get(f'jeda_{username}') == 'iya':
+        return
+    channel_id = db.get(f'channel_{username}')
+    if db.get(f'fsub_{username}') == 'iya' and channel_id:
+        return
+    if message.photo and not db.get(f'modeFoto_{username}'):
+        noop(update, context)
+    elif message.sticker and not db.get(f'modeSticker_{username}'):
+        noop(update, context)
+    elif message.document and not db.get(f'modeBerkas_{username}'):
+        noop(update, context)
+    elif message.text and not message.text.startswith('/') and not db.get(f'modeText_{username}'):
+        noop(update, context)
+
+
+def main():
+    bot = app.AnonymousBot.__new__(app.AnonymousBot)
+    bot.username = "benchbot"
+    bot.creator_id = 1
+    bot.config = app.BotSettings.load(bot.username)
+    bot.handle_text = bot.handle_photo = bot.handle_sticker = bot.handle_document = noop
+
+    for name, update in (("text", make_update(text="halo")), ("document", make_update(document=object()))):
+        # Best of several runs, so a noisy neighbour doesn't decide the comparison
+        before = min(timeit.repeat(lambda: legacy_dispatch(app.user_db, bot.username, bot.creator_id, update, None),
+                                   number=LOOPS, repeat=REPEAT)) / LOOPS * 1e9
+        after = min(timeit.repeat(lambda: bot.message_handler(update, None), number=LOOPS, repeat=REPEAT)) / LOOPS * 1e9
+        print(f"{name:<9} before {before:>6.0f} ns   after {after:>6.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
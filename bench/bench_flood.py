@@ -0,0 +1,67 @@
+"""Outbound Bot API calls caused by one flooding sender, with and without flood control.
+
+One user pushes text messages into a force-subscribe bot as fast as the
+webhook accepts them while a few regular users send one message each.
+Reports what reached the dispatcher and the API calls made once
+everything has been sent. FLOOD_*_RATE=0 is the unthrottled path.
+
+Usage: python bench/bench_flood.py [spam_messages]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(spam):
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, "bench"))
+    from fake_telegram import FakeTelegramAPI
+
+    api = FakeTelegramAPI().start()
+    os.environ["BOT_API_URL"] = api.base_url
+    import logging
+
+    import app
+
+    logging.disable(logging.WARNING)
+    bot = app.AnonymousBot("1000000001:" + "x" * 35, 1, "benchbot", 1000000001)
+    bot.config.channel_id = "-1001000000000"
+    bot.config.fsub = True
+    senders = [666] * spam + list(range(1000, 1010))
+    start = time.perf_counter()
+    for n, user in enumerate(senders, 1):
+        app.accept_update(bot, {"update_id": n, "message": {
+            "message_id": n, "date": 0, "text": f"pesan {n}", "chat": {"id": user, "type": "private"},
+            "from": {"id": user, "is_bot": False, "first_name": "User"}}})
+    accepted = time.perf_counter() - start
+    seen = -1
+    while seen != sum(api.calls.values()) or app.update_queue.depth() or app.outbox.pending():
+        seen = sum(api.calls.values())
+        time.sleep(0.5)
+    print(f"{app.update_queue.processed:4d} dispatched   {sum(api.calls.values()):4d} API calls   "
+          f"ingress {accepted / len(senders) * 1e6:5.1f} us/update   {dict(api.calls)}")
+
+
+def main():
+    spam = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{spam} messages from one sender + 10 regular senders")
+    for label, rate in (("unthrottled", "0"), ("flood control", None)):
+        env = dict(os.environ, TELEGRAM_TOKEN="123456789:" + "A" * 35, WEBHOOK_URL="https://bench.invalid",
+                   DATABASE_PATH=os.path.join(tempfile.mkdtemp(), "bench.db"),
+                   SEND_RATE_PER_CHAT="1000", SEND_BURST_PER_CHAT="1000", SEND_RATE_PER_BOT="1000",
+                   LOG_MEDIA_RATE="1000", LOG_MEDIA_BURST="1000")
+        if rate is not None:
+            env.update(FLOOD_USER_RATE=rate, FLOOD_BOT_RATE=rate)
+        print(f"{label:<14}", end=" ", flush=True)
+        subprocess.run([sys.executable, __file__, "--run", str(spam)], env=env, check=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        run(int(sys.argv[2]))
+    else:
+        main()
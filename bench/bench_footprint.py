@@ -0,0 +1,76 @@
+"""Memory, threads and sockets added per child bot.
+
+Compares a full Updater per bot (the previous layout) with AnonymousBot's
+shared-pool Bot + thread-less Dispatcher. Each bot makes one call to a
+local fake Bot API so connection pools are actually opened.
+
+Usage: python bench/bench_footprint.py [bots]
+"""
+import gc
+import os
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+
+api = FakeTelegramAPI().start()
+os.environ["BOT_API_URL"] = api.base_url
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+from telegram.ext import Updater  # noqa: E402
+
+import app  # noqa: E402
+
+
+def token(n):
+    return f"{1000000000 + n}:{'x' * 35}"
+
+
+def open_sockets():
+    count = 0
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            count += os.readlink(f'/proc/self/fd/{fd}').startswith('socket:')
+        except OSError:
+            pass
+    return count
+
+
+def measure(name, build, count):
+    gc.collect()
+    threads = threading.active_count()
+    sockets = open_sockets()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = []
+    for n in range(count):
+        bot = build(n)
+        bot.get_me()
+        keep.append(bot)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Sockets are counted on both ends of the in-process fake API, and the
+    # fake API serves each keep-alive connection on its own thread
+    print(f"{name:<14} {(after - before) / count / 1024:8.1f} KiB/bot   "
+          f"{(threading.active_count() - threads) / count:5.2f} threads/bot   "
+          f"{(open_sockets() - sockets) / 2 / count:5.2f} connections/bot")
+    return keep
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{count} bots")
+    measure("Updater", lambda n: Updater(token(n), base_url=app.BOT_API_URL, use_context=True).bot, count)
+    measure("AnonymousBot", lambda n: app.AnonymousBot(token(n), n, username=f"bot{n}", bot_id=1000000000 + n).bot,
+            count)
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Memory of registered vs loaded bots, and cold activation latency.
+
+Registers bots in a fresh database with webhooks already pointing at us,
+then measures BotManager.load_registry() (what startup now does), the
+first get_bot() of each bot (cold activation) and a repeat get_bot()
+(warm), and the memory held once every bot is loaded.
+
+Usage: python bench/bench_lazy.py [bots]
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import app  # noqa: E402
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    secrets = []
+    for n in range(count):
+        token = f"{1000000000 + n}:{'x' * 35}"
+        secret = app.webhook_secret(token)
+        app.user_db[f'bot_{n + 1}'] = {
+            'token': token, 'creator_id': n + 1, 'username': f'bot{n}', 'id': 1000000000 + n,
+            'webhook_url': f"{app.WEBHOOK_URL}/webhook/{secret}", 'allowed_updates': app.CHILD_ALLOWED_UPDATES,
+        }
+        secrets.append(secret)
+    app.user_db.flush()
+    manager = app.BotManager()
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    manager.load_registry()
+    indexed = tracemalloc.get_traced_memory()[0]
+    print(f"{count} bots: startup {time.perf_counter() - start:.2f}s, "
+          f"{(indexed - base) / count:.0f} B/bot while unloaded")
+
+    cold = []
+    for secret in secrets:
+        start = time.perf_counter()
+        manager.get_bot(secret)
+        cold.append(time.perf_counter() - start)
+    gc.collect()
+    loaded = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    warm = []
+    for secret in secrets:
+        start = time.perf_counter()
+        manager.get_bot(secret)
+        warm.append(time.perf_counter() - start)
+
+    print(f"loaded: {(loaded - indexed) / count / 1024:.1f} KiB/bot")
+    print(f"cold get_bot p50 {percentile(cold, 0.5) * 1000:.2f} ms   p99 {percentile(cold, 0.99) * 1000:.2f} ms")
+    print(f"warm get_bot p50 {percentile(warm, 0.5) * 1e6:.2f} us   p99 {percentile(warm, 0.99) * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
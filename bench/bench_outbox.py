@@ -0,0 +1,109 @@
+"""Burst throughput of the outbound send pipeline against a fake Bot API.
+
+Compares the old inline path (post, confirmation and log sent one after
+another inside the request) with Outbox, which acknowledges right after
+enqueueing. Reports ack latency and the time until every call completed.
+The outbox's rate limits are lifted unless set in the environment, as the
+inline path has none.
+
+Usage: python bench/bench_outbox.py [messages] [bots] [latency_seconds]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadgen import UNTHROTTLED  # noqa: E402
+
+# The inline path has no rate limits, so lift the outbox's for an equal comparison
+for name, value in UNTHROTTLED.items():
+    os.environ.setdefault(name, value)
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+from telegram import Bot  # noqa: E402
+from telegram.utils.request import Request  # noqa: E402
+
+import app  # noqa: E402
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+
+REQUEST_THREADS = 8  # Stand-in for the web server's request threads
+
+
+def make_bots(api, count):
+    request = Request(con_pool_size=app.SEND_WORKERS + 4)
+    bots = []
+    for n in range(count):
+        anon = app.AnonymousBot.__new__(app.AnonymousBot)
+        anon.token = f"{1000000000 + n}:{'x' * 35}"
+        anon.username = f"bot{n}"
+        anon.creator_id = n
+        anon.config = app.BotSettings(f"settings_bench{n}")
+        anon.config.channel_id = str(-1000000000000 - n)
+        anon.bot = Bot(anon.token, base_url=api.base_url, request=request)
+        bots.append(anon)
+    return bots
+
+
+def make_update(n):
+    user = SimpleNamespace(id=10000 + n, first_name="User", last_name=None)
+    message = SimpleNamespace(chat_id=user.id, message_id=n, text=f"menfes {n}", from_user=user)
+    return SimpleNamespace(message=message, effective_user=user, effective_message=message)
+
+
+def inline(anon, update):
+    bot = anon.bot
+    bot.send_message(chat_id=anon.config.channel_id, text=update.message.text)
+    bot.send_message(chat_id=update.message.chat_id, text="✅ Pesan berhasil terkirim!")
+    bot.send_message(chat_id=app.LOG_CHANNEL, text="log", parse_mode='HTML')
+
+
+def queued(anon, update):
+    anon.handle_text(update, SimpleNamespace(bot=anon.bot))
+
+
+def run(name, handler, bots, messages, wait_for=None):
+    acks = []
+
+    def one(n):
+        start = time.perf_counter()
+        handler(bots[n % len(bots)], make_update(n))
+        acks.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(REQUEST_THREADS) as pool:
+        list(pool.map(one, range(messages)))
+    acked = time.perf_counter() - start
+    if wait_for:
+        while not wait_for():
+            time.sleep(0.01)
+    total = time.perf_counter() - start
+    acks.sort()
+    p50 = acks[len(acks) // 2] * 1000
+    p99 = acks[int(len(acks) * 0.99) - 1] * 1000
+    print(f"{name:<8} acked in {acked:6.2f}s  done in {total:6.2f}s  "
+          f"ack p50 {p50:8.2f} ms  p99 {p99:8.2f} ms  {messages / total:7.1f} msg/s")
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.03
+    api = FakeTelegramAPI(latency=latency).start()
+    bots = make_bots(api, count)
+    print(f"{messages} messages over {count} bots, {latency * 1000:.0f} ms API latency")
+    run("inline", inline, bots, messages)
+    target = app.outbox.sent + 3 * messages
+    run("outbox", queued, bots, messages, wait_for=lambda: app.outbox.sent + app.outbox.failed >= target)
+    print("outbox", app.outbox.stats())
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
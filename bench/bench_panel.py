@@ -0,0 +1,77 @@
+"""Settings panel: Bot API calls per button press and render cost.
+
+Opens /settings as the creator against the fake Bot API, then presses
+every toggle button and "back to settings" on the panel message, and
+counts the editMessageText calls each press made. Also times rendering
+the panel from the settings against returning the cached render.
+
+Usage: python bench/bench_panel.py [loops]
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+
+api = FakeTelegramAPI().start()
+os.environ["BOT_API_URL"] = api.base_url
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import app  # noqa: E402
+
+CREATOR = {"id": 1, "is_bot": False, "first_name": "Owner"}
+CHAT = {"id": 1, "type": "private", "first_name": "Owner"}
+BUTTONS = ["toggle_pause", "toggle_fsub", "toggle_dedup", "toggle_text_mode", "toggle_photo_mode",
+           "toggle_sticker_mode", "toggle_doc_mode", "back_to_settings", "back_to_settings"]
+
+
+def press(bot, update_id, panel_id, data):
+    """Press data on the panel message; return the API calls it made"""
+    before = dict(api.calls)
+    app.process_bot_update(bot, {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": CREATOR, "chat_instance": "1", "data": data,
+        "message": {"message_id": panel_id, "date": 0, "chat": CHAT, "text": "panel"}}})
+    return {method: count - before.get(method, 0) for method, count in api.calls.items()
+            if count != before.get(method, 0)}
+
+
+def cpu_per_call(fn, loops):
+    start = time.process_time()
+    for _ in range(loops):
+        fn()
+    return (time.process_time() - start) / loops * 1e6
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bot = app.AnonymousBot("1000000001:" + "x" * 35, 1, "benchbot", 1000000001)
+    bot.config.channel_id = "-1001000000000"
+    bot.config.start_text = "Selamat datang <b>semua</b> & " * 10
+
+    api.calls.clear()
+    app.process_bot_update(bot, {"update_id": 1, "message": {
+        "message_id": 1, "date": 0, "chat": CHAT, "from": CREATOR, "text": "/settings",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 9}]}})
+    panel_id = next(iter(bot.panel_messages._data))
+    print(f"/settings            {dict(api.calls)}")
+    for n, data in enumerate(BUTTONS, start=2):
+        print(f"{data:<20} {press(bot, n, panel_id, data)}")
+
+    def render():
+        bot.config.version += 1
+        bot._settings_panel()
+
+    print(f"\nrender panel  {cpu_per_call(render, loops):6.2f}us")
+    print(f"cached panel  {cpu_per_call(bot._settings_panel, loops):6.2f}us")
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""CPU cost per child bot update: full dispatch vs the ingress pre-filter.
+
+For update kinds that no handler acts on, compares the old path
+(Update.de_json + Dispatcher.process_update) with AnonymousBot.prefilter on
+the raw payload. Also compares json and orjson parsing of the request body.
+No network: the bot is built from a known username and id.
+
+Usage: python bench/bench_prefilter.py [loops]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import app  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+USER = {"id": 2, "is_bot": False, "first_name": "Bench"}
+CHAT = {"id": 2, "type": "private", "first_name": "Bench"}
+
+
+def message(**extra):
+    return dict({"message_id": 10, "date": 1700000000, "chat": CHAT, "from": USER}, **extra)
+
+
+PAYLOADS = {
+    "edited_message": {"update_id": 1, "edited_message": dict(message(text="halo"), edit_date=1700000001)},
+    "photo (off)": {"update_id": 1, "message": message(photo=[
+        {"file_id": "AgAD", "file_unique_id": "AQAD", "width": 90, "height": 90, "file_size": 1000},
+        {"file_id": "AgAE", "file_unique_id": "AQAE", "width": 800, "height": 800, "file_size": 60000},
+    ])},
+    "video": {"update_id": 1, "message": message(video={
+        "file_id": "BAAD", "file_unique_id": "AgAD", "width": 640, "height": 360, "duration": 5})},
+}
+
+
+def cpu_per_call(fn, loops):
+    start = time.process_time()
+    for _ in range(loops):
+        fn()
+    return (time.process_time() - start) / loops * 1e6
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    bot = app.AnonymousBot("987654321:" + "B" * 35, 1, "benchbot", 987654321)
+    bot.config.photo_enabled = False
+
+    print(f"{'update':<15} {'dispatch':>10} {'prefilter':>10}")
+    for name, payload in PAYLOADS.items():
+        assert not bot.prefilter(payload)
+        full = cpu_per_call(lambda: app.process_bot_update(bot, payload), loops)
+        fast = cpu_per_call(lambda: bot.prefilter(payload), loops)
+        print(f"{name:<15} {full:>8.1f}us {fast:>8.2f}us")
+
+    body = json.dumps(PAYLOADS["photo (off)"]).encode()
+    print(f"\njson.loads   {cpu_per_call(lambda: json.loads(body), loops * 10):.2f}us")
+    if orjson is not None:
+        print(f"orjson.loads {cpu_per_call(lambda: orjson.loads(body), loops * 10):.2f}us")
+
+
+if __name__ == "__main__":
+    main()
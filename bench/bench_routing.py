@@ -0,0 +1,40 @@
+"""Webhook routing latency against the number of registered bots.
+
+Usage: python bench/bench_routing.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import app  # noqa: E402
+
+
+class StubBot:
+    def __init__(self, n):
+        self.token = f"{1000000000 + n}:{'x' * 35}"
+        self.creator_id = n
+        self.webhook_secret = app.webhook_secret(self.token)
+
+
+def main():
+    print(f"{'bots':>8} {'get_bot (ns)':>14} {'legacy token (ns)':>18}")
+    for size in (10, 100, 1000, 10000, 50000):
+        manager = app.BotManager()
+        bots = [StubBot(n) for n in range(size)]
+        for bot in bots:
+            manager._add(bot)
+        last = bots[-1]
+        loops = 200000
+        secret_ns = timeit.timeit(lambda: manager.get_bot(last.webhook_secret), number=loops) / loops * 1e9
+        token_ns = timeit.timeit(lambda: manager.get_bot(last.token), number=loops) / loops * 1e9
+        print(f"{size:>8} {secret_ns:>14.0f} {token_ns:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""End-to-end throughput with 1..N worker processes.
+
+Registers a few hundred bots in a fresh database, starts app.py against
+the fake Bot API with WORKER_PROCESSES=N, posts text updates for all bots
+to the front port and measures how fast the resulting sendMessage calls
+(post, confirmation and log, three per update) reach the fake API.
+Scaling is bounded by the machine's core count.
+
+Usage: python bench/bench_scaling.py [updates] [bots] [max_workers]
+"""
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+
+CLIENTS = 32
+
+
+def token(n):
+    return f"{1000000000 + n}:{'x' * 35}"
+
+
+def register_bots(db_path, count):
+    """Write registry records the way create_bot does, without network calls"""
+    code = f"""
+import app
+for n in range({count}):
+    tok = f"{{1000000000 + n}}:{{'x' * 35}}"
+    secret = app.webhook_secret(tok)
+    app.user_db[f'bot_{{n}}'] = {{'token': tok, 'creator_id': n, 'username': f'bot{{n}}', 'id': 1000000000 + n,
+                                'webhook_url': f'{{app.WEBHOOK_URL}}/webhook/{{secret}}',
+                                'allowed_updates': app.CHILD_ALLOWED_UPDATES}}
+    app.user_db[f'webhook_{{secret}}'] = n
+app.user_db.flush()
+"""
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=dict(os.environ, DATABASE_PATH=db_path),
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for(port):
+    for _ in range(300):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"port {port} did not come up")
+
+
+def post_updates(port, secrets, total):
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            user = 5000 + n % 997
+            body = json.dumps({"update_id": n, "message": {
+                "message_id": n, "date": 0, "chat": {"id": user, "type": "private"},
+                "from": {"id": user, "is_bot": False, "first_name": "User"}, "text": f"menfes {n}"}}).encode()
+            conn.request("POST", f"/webhook/{secrets[n % len(secrets)]}", body, {"Content-Type": "application/json"})
+            conn.getresponse().read()
+
+    threads = [threading.Thread(target=client) for _ in range(CLIENTS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run(workers, total, count, api):
+    import hashlib
+    db_path = os.path.join(tempfile.mkdtemp(), "scaling.db")
+    env = dict(os.environ, TELEGRAM_TOKEN="123456789:" + "A" * 35, WEBHOOK_URL="https://bench.invalid",
+               BOT_API_URL=api.base_url, DATABASE_PATH=db_path, WORKER_PROCESSES=str(workers),
+               WORKER_BASE_PORT=str(19100 + workers * 10), PORT=str(19000 + workers),
+               SEND_RATE_PER_CHAT="100000", SEND_BURST_PER_CHAT="100000", SEND_RATE_PER_BOT="100000")
+    os.environ.update({k: env[k] for k in ("TELEGRAM_TOKEN", "WEBHOOK_URL")})
+    register_bots(db_path, count)
+    secrets = [hashlib.sha256(token(n).encode()).hexdigest()[:32] for n in range(count)]
+
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py")], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(19000 + workers)
+        if workers > 1:
+            for index in range(workers):
+                wait_for(19100 + workers * 10 + index)
+        before = api.calls['sendMessage']
+        start = time.perf_counter()
+        post_updates(19000 + workers, secrets, total)
+        while api.calls['sendMessage'] - before < 3 * total:
+            if time.perf_counter() - start > 300:
+                break
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        done = (api.calls['sendMessage'] - before) // 3
+        print(f"{workers} worker(s): {done / elapsed:8.1f} updates/s ({done}/{total} in {elapsed:.1f}s)")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1
+    api = FakeTelegramAPI().start()
+    print(f"{total} updates over {count} bots, {os.cpu_count()} CPU(s)")
+    workers = 1
+    while workers <= max_workers:
+        run(workers, total, count, api)
+        workers *= 2
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Load test of the webhook front ends: Flask development server vs ASGI.
+
+Each server runs in its own process with one registered AnonymousBot,
+talking to a FakeTelegramAPI in the same process that answers every call
+after a fixed latency. Flood control and the outbound rate limits are
+lifted so every update goes through the handlers. A pool of keep-alive
+clients posts updates to /webhook/<secret> and the script reports
+sustained requests/second and latency percentiles.
+
+Usage: python bench/bench_server.py [requests] [clients] [api_latency_seconds]
+"""
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+from loadgen import UNTHROTTLED  # noqa: E402
+
+TOKEN = "1000000001:" + "x" * 35
+
+
+def serve(kind, port, latency):
+    sys.path.insert(0, ROOT)
+    api = FakeTelegramAPI(latency=latency).start()
+    os.environ["BOT_API_URL"] = api.base_url
+    for name, value in dict(UNTHROTTLED, FLOOD_USER_RATE="0", FLOOD_BOT_RATE="0").items():
+        os.environ.setdefault(name, value)
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+    os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+    os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+    import logging
+
+    import app
+
+    logging.disable(logging.INFO)
+    bot = app.AnonymousBot(TOKEN, 1, "benchbot", 1000000001)
+    bot.config.channel_id = "-1001000000000"
+    app.bot_manager._add(bot)
+    if kind == "flask":
+        app.app.run(host="127.0.0.1", port=port, threaded=True)
+    else:
+        app.uvicorn.run(app.asgi_app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def update_body(n):
+    return json.dumps({
+        "update_id": n,
+        "message": {"message_id": n, "date": 0, "chat": {"id": n % 1000, "type": "private"},
+                    "from": {"id": n % 1000, "is_bot": False, "first_name": "User"}, "text": "halo"},
+    }).encode()
+
+
+def load(port, total, clients):
+    path = f"/webhook/{_secret()}"
+    latencies = []
+    errors = []
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            start = time.perf_counter()
+            try:
+                conn.request("POST", path, update_body(n), {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except Exception as e:
+                errors.append(type(e).__name__)
+                conn = http.client.HTTPConnection("127.0.0.1", port)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return total / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1], len(errors)
+
+
+def _secret():
+    import hashlib
+    return hashlib.sha256(TOKEN.encode()).hexdigest()[:32]
+
+
+def handled(port, total, timeout=60):
+    """(processed, failed) updates once the app's queue has worked through total updates"""
+    deadline = time.monotonic() + timeout
+    while True:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        conn.request("GET", "/stats")
+        updates = json.loads(conn.getresponse().read())["updates"]
+        if updates["processed"] + updates["failed"] >= total or time.monotonic() > deadline:
+            return updates["processed"], updates["failed"]
+        time.sleep(0.1)
+
+
+def wait_for(port):
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    print(f"{total} requests, {clients} clients, {latency * 1000:.0f} ms API latency")
+    for port, kind in ((18081, "flask"), (18082, "asgi")):
+        server = subprocess.Popen([sys.executable, __file__, "--serve", kind, str(port), str(latency)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(port)
+            rps, p50, p99, errors = load(port, total, clients)
+            processed, failed = handled(port, total)
+            print(f"{kind:<6} {rps:8.1f} req/s   p50 {p50 * 1000:7.1f} ms   p99 {p99 * 1000:7.1f} ms   errors {errors}   "
+                  f"handled {processed} (failed {failed})")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,69 @@
+"""Memory held by abandoned conversation flows, user_db flags vs SessionStore.
+
+Opens a flow (like pressing "Support") for --flows distinct users and
+never finishes it, the way most flows end. The old path wrote a
+support_<id> flag into user_db; the new one uses SessionStore with the
+app's SESSION_MAX cap. Reports the memory still held afterwards and the
+cost of the per-message "is this user in a flow" check.
+
+Usage: python bench/bench_sessions.py [flows]
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import app  # noqa: E402
+
+
+def held(fill):
+    """MiB still allocated after fill() ran"""
+    gc.collect()
+    tracemalloc.start()
+    fill()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / 2 ** 20
+
+
+def cpu_per_call(fn, loops):
+    start = time.process_time()
+    for n in range(loops):
+        fn(n)
+    return (time.process_time() - start) / loops * 1e6
+
+
+def main():
+    flows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    print(f"{flows} abandoned flows, SESSION_MAX {app.SESSION_MAX}")
+
+    sessions = app.SessionStore(app.SESSION_TTL, app.SESSION_MAX)
+
+    def new():
+        for user_id in range(flows):
+            sessions.set(('support', user_id), True)
+
+    def old():
+        for user_id in range(flows):
+            app.user_db[f'support_{user_id}'] = True
+        app.user_db.flush()  # Only the read cache stays behind
+
+    print(f"SessionStore   {held(new):7.1f} MiB held ({len(sessions)} entries, {sessions.evicted} evicted)")
+    print(f"user_db flags  {held(old):7.1f} MiB held, plus {os.path.getsize(app.DATABASE_PATH) / 2 ** 20:.1f} MiB on disk")
+
+    # Users who never opened a flow, as most private messages to the main bot are
+    others = flows * 2
+    print(f"\ncheck, user_db       {cpu_per_call(lambda n: app.user_db.get(f'support_{others + n}'), 100000):.2f}us")
+    print(f"check, SessionStore  {cpu_per_call(lambda n: sessions.get(('support', others + n)), 100000):.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Reads/writes per second of SettingsStore compared with a plain dict.
+
+Usage: python bench/bench_store.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:" + "A" * 35)
+os.environ.setdefault("WEBHOOK_URL", "https://bench.invalid")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+import app  # noqa: E402
+
+KEYS = [f"startText_bot{n}" for n in range(5000)]
+ROUNDS = 40
+
+
+def rate(fn):
+    start = time.perf_counter()
+    fn()
+    return ROUNDS * len(KEYS) / (time.perf_counter() - start)
+
+
+def run(name, db):
+    def writes():
+        for _ in range(ROUNDS):
+            for key in KEYS:
+                db[key] = "Halo!"
+
+    def reads():
+        for _ in range(ROUNDS):
+            for key in KEYS:
+                db.get(key)
+
+    print(f"{name:<14} writes/s {rate(writes):>12,.0f}   reads/s {rate(reads):>12,.0f}")
+
+
+def main():
+    run("dict", {})
+    store = app.SettingsStore(os.path.join(tempfile.mkdtemp(), "store.db"))
+    run("SettingsStore", store)
+    start = time.perf_counter()
+    store.flush()
+    print(f"final flush of {len(KEYS)} keys: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""In-process stand-in for api.telegram.org.
+
+Serves ``/bot<token>/<method>`` with canned Bot API responses after a
+configurable latency, and can answer 429 with retry_after when a chat
+receives more than ``chat_limit`` messages per second. getChatMember
+reports every user with ``member_status``.
+
+    api = FakeTelegramAPI(latency=0.03).start()
+    bot = Bot(token, base_url=api.base_url)
+"""
+import itertools
+import json
+from email.parser import BytesParser
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SEND_METHODS = {'sendMessage', 'sendPhoto', 'sendSticker', 'sendDocument', 'copyMessage', 'sendMediaGroup'}
+
+
+class FakeTelegramAPI:
+    def __init__(self, latency: float = 0.0, chat_limit: int = 0, retry_after: int = 1,
+                 member_status: str = 'member', host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.chat_limit = chat_limit  # Sends per chat per second before a 429, 0 = unlimited
+        self.retry_after = retry_after
+        self.member_status = member_status
+        self.calls = Counter()  # {method: count}
+        self.throttled = 0
+        self._message_ids = itertools.count(1)
+        self._recent = defaultdict(deque)  # {(token, chat_id): send timestamps}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> 'FakeTelegramAPI':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _throttle(self, token, chat_id):
+        if not self.chat_limit:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent[(token, chat_id)]
+            while recent and recent[0] < now - 1:
+                recent.popleft()
+            if len(recent) >= self.chat_limit:
+                self.throttled += 1
+                return True
+            recent.append(now)
+        return False
+
+    def respond(self, token: str, method: str, params: dict):
+        """Return (http_status, body) for one API call"""
+        with self._lock:
+            self.calls[method] += 1
+        if method in SEND_METHODS and self._throttle(token, str(params.get('chat_id'))):
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        
+        bot_id = int(token.split(':')[0])
+        chat = {'id': params.get('chat_id', 0), 'type': 'private', 'first_name': 'User'}
+        if method == 'getMe':
+            result = {'id': bot_id, 'is_bot': True, 'first_name': f'bot{bot_id}', 'username': f'bot{bot_id}'}
+        elif method in ('setWebhook', 'deleteWebhook', 'deleteMessage', 'setMyCommands', 'answerCallbackQuery'):
+            result = True
+        elif method == 'copyMessage':
+            result = {'message_id': next(self._message_ids)}
+        elif method == 'sendMediaGroup':
+            media = params.get('media') or []
+            if isinstance(media, str):
+                media = json.loads(media)
+            result = [{'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': chat}
+                      for _ in media]
+        elif method == 'getChatMember':
+            user = {'id': int(params.get('user_id', 0)), 'is_bot': False, 'first_name': 'User'}
+            result = {'user': user, 'status': self.member_status}
+        elif method == 'getChat':
+            chat_id = params.get('chat_id', 0)
+            result = {'id': chat_id, 'type': 'channel', 'title': f'Channel {chat_id}',
+                      'username': f'channel{str(chat_id).lstrip("-")}'}
+        else:
+            result = {'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': chat}
+            if 'text' in params:
+                result['text'] = params['text']
+        return 200, {'ok': True, 'result': result}
+
+    @staticmethod
+    def parse_body(content_type: str, body: bytes) -> dict:
+        """Parameters of a JSON or multipart/form-data (e.g. sendMediaGroup) request"""
+        if not body:
+            return {}
+        if 'json' in content_type:
+            return json.loads(body)
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode()
+                    for part in message.get_payload()}
+        return {}
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                params = api.parse_body(self.headers.get('Content-Type', ''), body)
+                _, token, method = self.path.split('/', 2)
+                if api.latency:
+                    time.sleep(api.latency)
+                status, payload = api.respond(token[3:], method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
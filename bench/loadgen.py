@@ -0,0 +1,282 @@
+"""End-to-end load test of app.py against the local fake Bot API.
+
+Starts FakeTelegramAPI in this process, then the real app (app.run()) in a
+child process pointed at it through BOT_API_URL, with --bots child bots
+seeded into a fresh database and restored at startup. Keep-alive clients
+post a synthetic mix of updates to /webhook and /webhook/<secret> across
+all bots; the script reports webhook throughput and ack latency, the time
+until the app made every resulting API call, peak thread count and RSS of
+the server (children included), and the API calls the fake received.
+
+The app's own outbound rate limits are lifted unless set in the
+environment, so the run measures the app rather than Telegram's limits;
+use --chat-limit to have the fake answer 429s instead.
+
+Usage: python bench/loadgen.py [--bots 50] [--requests 5000] [--clients 32]
+       [--latency 0.03] [--chat-limit 0] [--workers 1] [--server asgi|flask]
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+
+MAIN_TOKEN = "123456789:" + "A" * 35
+CHANNEL_ID = "-1001000000000"
+UNTHROTTLED = {"SEND_RATE_PER_BOT": "10000", "SEND_RATE_PER_CHAT": "10000", "SEND_BURST_PER_CHAT": "10000",
+               "LOG_MEDIA_RATE": "10000", "LOG_MEDIA_BURST": "10000"}
+
+
+def bot_token(bot_id):
+    return f"{bot_id}:{'x' * 35}"
+
+
+def secret(token):
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def seed_and_serve(ids_path):
+    """Child process: register the bots listed in ids_path in the fresh database, then run the app"""
+    sys.path.insert(0, ROOT)
+    import logging
+
+    import app
+
+    logging.disable(logging.WARNING)
+    with open(ids_path) as f:
+        bot_ids = json.load(f)
+    for n, bot_id in enumerate(bot_ids):
+        token = bot_token(bot_id)
+        app.user_db[f'bot_{n + 1}'] = {'token': token, 'creator_id': n + 1, 'username': f'bot{bot_id}', 'id': bot_id}
+        config = app.BotSettings(f'settings_bot{bot_id}')
+        config.channel_id = CHANNEL_ID
+        config.fsub = n % 2 == 0  # Half the bots check channel membership
+        config.save()
+    app.user_db.flush()
+    app.run()
+
+
+def start_app(api, bot_ids, port, server="asgi", workers=1):
+    """Run app.py against api in a child process with bot_ids registered"""
+    workdir = tempfile.mkdtemp()
+    ids_path = os.path.join(workdir, "bots.json")
+    with open(ids_path, "w") as f:
+        json.dump(list(bot_ids), f)
+    env = dict(UNTHROTTLED, **os.environ)
+    env.update(TELEGRAM_TOKEN=MAIN_TOKEN, WEBHOOK_URL="https://bench.invalid", BOT_API_URL=api.base_url,
+               DATABASE_PATH=os.path.join(workdir, "bench.db"), PORT=str(port),
+               WEB_SERVER=server, WORKER_PROCESSES=str(workers), WORKER_BASE_PORT=str(port + 1))
+    env.pop("CAPTURE_PATH", None)
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", ids_path], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def message(n, user, **content):
+    return {"message_id": n, "date": int(time.time()), "chat": {"id": user, "type": "private"},
+            "from": {"id": user, "is_bot": False, "first_name": "User"}, **content}
+
+
+def synthetic_update(n, rng):
+    """One update of the traffic mix, keyed by update_id n"""
+    user = 100000 + rng.randrange(5000)
+    roll = rng.random()
+    if roll < 0.6:
+        return {"update_id": n, "message": message(n, user, text=f"pesan {n}")}
+    if roll < 0.75:
+        photo = [{"file_id": f"ph{n}", "file_unique_id": f"u{n}", "width": 800, "height": 600}]
+        return {"update_id": n, "message": message(n, user, photo=photo)}
+    if roll < 0.85:
+        return {"update_id": n, "message": message(n, user, text="/start",
+                                                    entities=[{"type": "bot_command", "offset": 0, "length": 6}])}
+    return {"update_id": n, "edited_message": dict(message(n, user, text="ubah"), edit_date=int(time.time()))}
+
+
+def drive(port, total, clients, paths, seed):
+    """Post total updates spread over paths; return (seconds, latencies, errors)"""
+    rng = random.Random(seed)
+    jobs = [(rng.choice(paths), json.dumps(synthetic_update(n + 1, rng)).encode()) for n in range(total)]
+    jobs.reverse()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                path, body = jobs.pop()
+            start = time.perf_counter()
+            try:
+                conn.request("POST", path, body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except Exception as e:
+                errors.append(type(e).__name__)
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def process_tree(pid):
+    pids = [pid]
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+        except OSError:
+            pass
+    return pids
+
+
+def footprint(pid):
+    """(threads, RSS in MiB) of pid and its children, from /proc"""
+    threads = rss = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        threads += int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss += int(line.split()[1])
+        except OSError:
+            pass
+    return threads, rss / 1024
+
+
+def backlog(port):
+    """Updates and send jobs still queued in the app (worker 0 in multi-process mode)"""
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        conn.request("GET", "/stats")
+        stats = json.loads(conn.getresponse().read())
+        return stats['updates']['depth'] + stats['outbox']['pending']
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def wait_until_quiet(api, port, settle=0.5, timeout=120):
+    """Wait until the app has nothing queued and the fake saw no new calls for settle seconds"""
+    last, quiet_since, deadline = -1, time.monotonic(), time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        seen = sum(api.calls.values())
+        if seen != last:
+            last, quiet_since = seen, time.monotonic()
+        elif time.monotonic() - quiet_since >= settle and not backlog(port):
+            return quiet_since
+        time.sleep(0.05)
+    return None
+
+
+def wait_for(port, process, workers=1):
+    """Wait until the app answers on port and, with several workers, on each worker's port"""
+    ports = [port] + ([port + 1 + index for index in range(workers)] if workers > 1 else [])
+    for port in ports:
+        for _ in range(600):
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with {process.returncode}")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                conn.request("GET", "/")
+                if conn.getresponse().status == 200:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.1)
+        else:
+            raise RuntimeError(f"server on port {port} did not start")
+
+
+def measure(api, server, port, load):
+    """Run load() (returning seconds, latencies, errors) against the app and print the report"""
+    peak = [0, 0.0]
+    sampling = threading.Event()
+
+    def sample():
+        while not sampling.is_set():
+            threads, rss = footprint(server.pid)
+            peak[0], peak[1] = max(peak[0], threads), max(peak[1], rss)
+            time.sleep(0.2)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    begun = time.monotonic()
+    elapsed, latencies, errors = load()
+    settled = wait_until_quiet(api, port)
+    sampling.set()
+    sampler.join()
+
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000
+    print(f"webhook   {len(latencies) / elapsed:8.1f} req/s   p50 {p50:6.1f} ms   p99 {p99:6.1f} ms   "
+          f"errors {len(errors)}")
+    calls = f"{sum(api.calls.values())} calls, {api.throttled} answered 429"
+    if settled is None:
+        print(f"API work still pending after the timeout ({calls})")
+    else:
+        print(f"processed all API work in {settled - begun:.2f}s ({calls})")
+    print(f"peak      {peak[0]} threads   {peak[1]:.0f} MiB RSS")
+    print("api calls " + ", ".join(f"{method} {count}" for method, count in api.calls.most_common()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bots", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.03, help="fake API latency, seconds")
+    parser.add_argument("--chat-limit", type=int, default=0, help="sends per chat per second before a 429")
+    parser.add_argument("--workers", type=int, default=1, help="WORKER_PROCESSES for the app")
+    parser.add_argument("--server", default="asgi", choices=("asgi", "flask"))
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeTelegramAPI(latency=args.latency, chat_limit=args.chat_limit).start()
+    bot_ids = [1000000000 + n for n in range(args.bots)]
+    server = start_app(api, bot_ids, args.port, args.server, args.workers)
+    try:
+        started = time.perf_counter()
+        wait_for(args.port, server, args.workers)
+        print(f"startup with {args.bots} bots: {time.perf_counter() - started:.2f}s")
+        wait_until_quiet(api, args.port)
+        api.calls.clear()
+
+        print(f"{args.requests} updates, {args.clients} clients, {args.bots} bots, "
+              f"{args.latency * 1000:.0f} ms API latency, {args.server}, {args.workers} worker(s)")
+        paths = ["/webhook"] + [f"/webhook/{secret(bot_token(bot_id))}" for bot_id in bot_ids]
+        measure(api, server, args.port,
+                lambda: drive(args.port, args.requests, args.clients, paths, args.seed))
+    finally:
+        server.terminate()
+        server.wait()
+        api.stop()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        seed_and_serve(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,124 @@
+"""Replay captured webhook traffic against the app and the fake Bot API.
+
+Reads a file written with CAPTURE_PATH set and posts every update to
+/webhook (bot 0) or the matching /webhook/<secret>, keeping the recorded
+arrival gaps divided by --speed (0 sends as fast as the clients can).
+Every captured bot is registered in a fresh app instance under a
+stand-in token, so two builds see identical load. Reports the same
+figures as loadgen.py plus how far the sender fell behind the schedule.
+
+Usage: python bench/replay.py capture.jsonl [--speed 1] [--clients 64]
+       [--latency 0.03] [--chat-limit 0] [--workers 1] [--server asgi|flask]
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegramAPI  # noqa: E402
+from loadgen import bot_token, measure, secret, start_app, wait_for, wait_until_quiet  # noqa: E402
+
+
+def load_capture(path):
+    """Return [(arrival offset, bot id, body)] sorted by arrival"""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                entries.append((record["t"], record["bot"], json.dumps(record["update"]).encode()))
+    entries.sort(key=lambda entry: entry[0])
+    first = entries[0][0] if entries else 0
+    return [(t - first, bot_id, body) for t, bot_id, body in entries]
+
+
+def replay(port, entries, speed, clients):
+    """Post entries on schedule; return (seconds, latencies, errors, worst lateness)"""
+    jobs = list(reversed(entries))
+    latencies, errors, late = [], [], [0.0]
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                offset, bot_id, body = jobs.pop()
+            due = start + (offset / speed if speed else 0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                late[0] = max(late[0], -delay)
+            path = f"/webhook/{secret(bot_token(bot_id))}" if bot_id else "/webhook"
+            sent = time.perf_counter()
+            try:
+                conn.request("POST", path, body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except Exception as e:
+                errors.append(type(e).__name__)
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            latencies.append(time.perf_counter() - sent)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies), errors, late[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression, 0 = no pacing")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.03, help="fake API latency, seconds")
+    parser.add_argument("--chat-limit", type=int, default=0, help="sends per chat per second before a 429")
+    parser.add_argument("--workers", type=int, default=1, help="WORKER_PROCESSES for the app")
+    parser.add_argument("--server", default="asgi", choices=("asgi", "flask"))
+    parser.add_argument("--port", type=int, default=18190)
+    args = parser.parse_args()
+
+    entries = load_capture(args.capture)
+    if not entries:
+        sys.exit(f"{args.capture} holds no updates")
+    bot_ids = sorted({bot_id for _, bot_id, _ in entries if bot_id})
+    duration = entries[-1][0]
+    print(f"{len(entries)} updates for {len(bot_ids)} bots over {duration:.1f}s, replayed at "
+          f"{'full speed' if not args.speed else f'{args.speed:g}x'}, {args.latency * 1000:.0f} ms API latency, "
+          f"{args.server}, {args.workers} worker(s)")
+
+    api = FakeTelegramAPI(latency=args.latency, chat_limit=args.chat_limit).start()
+    server = start_app(api, bot_ids, args.port, args.server, args.workers)
+    try:
+        wait_for(args.port, server, args.workers)
+        wait_until_quiet(api, args.port)
+        api.calls.clear()
+        lateness = []
+
+        def load():
+            elapsed, latencies, errors, late = replay(args.port, entries, args.speed, args.clients)
+            lateness.append(late)
+            return elapsed, latencies, errors
+
+        measure(api, server, args.port, load)
+        print(f"schedule  fell behind by at most {lateness[0] * 1000:.1f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()